@@ -1,4 +1,6 @@
 #!/bin/bash
 log=/home/jibri/records_handler.log
 date >> $log 2>&1
-curl -X POST --header "Authorization:Bearer $RECORDS_HANDLER_TOKEN" api:80/api/records-handler/ >> $log 2>&1
\ No newline at end of file
+# asks the records worker for a full scan, the response is the ingestion queue status
+curl -sS -X POST --header "Authorization:Bearer $RECORDS_HANDLER_TOKEN" api:80/api/records-handler/ >> $log 2>&1
+echo >> $log
@@ -0,0 +1,46 @@
+from logging.config import fileConfig
+
+from sqlalchemy import engine_from_config, inspect, pool
+
+from alembic import context
+from app.core.config import settings
+from app.db.base import Base
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+config.set_main_option('sqlalchemy.url', settings.SQLALCHEMY_DATABASE_URI.replace('%', '%%'))
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    context.configure(url=config.get_main_option('sqlalchemy.url'), target_metadata=target_metadata,
+                      literal_binds=True, dialect_opts={'paramstyle': 'named'})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = engine_from_config(config.get_section(config.config_ini_section, {}), prefix='sqlalchemy.',
+                                     poolclass=pool.NullPool)
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        if connection.dialect.name == 'sqlite' and not inspect(connection).has_table('jitsi_records'):
+            create_sqlite_schema(connection)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+def create_sqlite_schema(connection):
+    # the migrations target mysql, sqlite can't add the stored has_url column with ALTER,
+    # so new local sqlite databases get the current models and are stamped with the head revision,
+    # later migrations run on them as usual
+    Base.metadata.create_all(connection)
+    context.get_context().stamp(context.script, 'heads')
+    connection.commit()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
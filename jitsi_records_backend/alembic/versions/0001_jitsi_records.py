@@ -0,0 +1,40 @@
+"""jitsi_records table
+
+The table predates migrations, it is created only when missing.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('jitsi_records'):
+        op.create_table(
+            'jitsi_records',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('conversation_id', sa.Integer(), nullable=False),
+            sa.Column('advisor_id', sa.Integer(), nullable=False),
+            sa.Column('student_id', sa.Integer(), nullable=False),
+            sa.Column('start_time', sa.DateTime()),
+            sa.Column('url', sa.String(2083)),
+            sa.Column('creation_date', sa.DateTime()),
+            sa.Column('delete_reason', sa.Enum('expired', name='deletereasonenum'), nullable=True),
+        )
+        op.create_index('ix_jitsi_records_id', 'jitsi_records', ['id'])
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('jitsi_records')}
+    if 'ix_jitsi_records_start_time' not in indexes:
+        op.create_index('ix_jitsi_records_start_time', 'jitsi_records', ['start_time'])
+
+
+def downgrade():
+    op.drop_index('ix_jitsi_records_start_time', table_name='jitsi_records')
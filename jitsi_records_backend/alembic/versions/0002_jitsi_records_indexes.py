@@ -0,0 +1,46 @@
+"""jitsi_records has_url column, list indexes and unique recording key
+
+Duplicated recordings are removed before the unique key is added, the row with a url
+(and the lowest id among them) is kept.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+RECORDING = ('conversation_id', 'advisor_id', 'student_id', 'start_time')
+
+
+def upgrade():
+    op.add_column('jitsi_records', sa.Column('has_url', sa.Boolean(),
+                                             sa.Computed("url IS NOT NULL AND url <> ''", persisted=True)))
+
+    same_recording = ' AND '.join(f'kept.{column} = duplicate.{column}' for column in RECORDING)
+    better_kept = ('(kept.has_url > duplicate.has_url '
+                   'OR (kept.has_url = duplicate.has_url AND kept.id < duplicate.id))')
+    if op.get_bind().dialect.name == 'mysql':
+        # mysql can't select from the table it deletes from in a subquery
+        op.execute(f'DELETE duplicate FROM jitsi_records duplicate JOIN jitsi_records kept '
+                   f'ON {same_recording} AND {better_kept}')
+    else:
+        op.execute(f'DELETE FROM jitsi_records AS duplicate WHERE EXISTS ('
+                   f'SELECT 1 FROM jitsi_records kept WHERE {same_recording} AND {better_kept})')
+
+    op.create_unique_constraint('uq_jitsi_records_recording', 'jitsi_records', list(RECORDING))
+    op.create_index('ix_jitsi_records_advisor_list', 'jitsi_records', ['advisor_id', 'has_url', 'start_time', 'id'])
+    op.create_index('ix_jitsi_records_student_list', 'jitsi_records', ['student_id', 'has_url', 'start_time', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_jitsi_records_student_list', table_name='jitsi_records')
+    op.drop_index('ix_jitsi_records_advisor_list', table_name='jitsi_records')
+    op.drop_constraint('uq_jitsi_records_recording', 'jitsi_records', type_='unique')
+    op.drop_column('jitsi_records', 'has_url')
@@ -0,0 +1,22 @@
+"""jitsi_records checksum_sha256 column
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('jitsi_records', sa.Column('checksum_sha256', sa.String(64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('jitsi_records', 'checksum_sha256')
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends, Response
+
+from app.background_tasks.job_queue import get_settings_job_queue
+from app.core.config import get_settings
+from app.core.metrics import CONTENT_TYPE, render, watch_job_queue
+from app.core.security import verify_metrics_token
+
+router = APIRouter()
+
+# the API shares the records volume and the job queue with the worker
+watch_job_queue(lambda: get_settings_job_queue(get_settings()))
+
+
+@router.get("/metrics", include_in_schema=False, dependencies=[Depends(verify_metrics_token)])
+def get_metrics():
+    return Response(render(), media_type=CONTENT_TYPE)
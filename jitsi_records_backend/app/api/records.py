@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.status import HTTP_304_NOT_MODIFIED
 
-from app.core.deps import get_db
+from app.core.deps import get_async_db
+from app.core.metrics import api_stage_seconds, response_cache_requests, timed
+from app.core.response_cache import etag_matches, response_cache
 from app.core.security import check_greyt_auth_token
-from app.crud.jitsi_record import CRUDJitsiRecord, MultiResult
+from app.crud.jitsi_record import CRUDJitsiRecord, MultiResult, multi_result_adapter
 from app.schemas import Pagination
 
 router = APIRouter()
@@ -12,5 +16,25 @@ router = APIRouter()
 @router.get("/", summary="List records", response_model=MultiResult)
 async def handle_new_records(user: dict = Depends(check_greyt_auth_token),
                              pagination: Pagination = Depends(),
-                             db: Session = Depends(get_db)):
-    return CRUDJitsiRecord.get_multi(db=db, **pagination.dict(), user_id=user['id'])
+                             if_none_match: str = Header(None),
+                             db: AsyncSession = Depends(get_async_db)):
+    key = tuple(pagination.dict().values())
+    # read before the records, so a page queried while an invalidation arrives is stored as stale
+    # a blocking sqlite read, kept off the event loop
+    generation = await run_in_threadpool(response_cache.generation, user['id'])
+    cached = response_cache.get(user['id'], key, generation)
+    response_cache_requests.labels(result='miss' if cached is None else 'hit').inc()
+    if cached is None:
+        try:
+            result = await CRUDJitsiRecord.get_multi(db=db, **pagination.dict(), user_id=user['id'])
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {exc}")
+        with timed(api_stage_seconds, 'serialize'):
+            body = multi_result_adapter.dump_json(multi_result_adapter.validate_python(result))
+        etag = response_cache.set(user['id'], key, body, generation)
+    else:
+        body, etag = cached
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
@@ -1,20 +1,42 @@
-from fastapi import APIRouter, Response, BackgroundTasks, Depends
-from sqlalchemy.orm import Session
-from starlette.status import HTTP_204_NO_CONTENT
+import time
 
-from app.background_tasks.records_handler import handle_records
+from fastapi import APIRouter, Depends, Response
+from starlette.status import HTTP_202_ACCEPTED, HTTP_204_NO_CONTENT
+
+from app.background_tasks.job_queue import JobState, get_settings_job_queue
+from app.background_tasks.scheduler import SCHEDULER_STATUS
 from app.core.config import get_settings, BaseSettings
-from app.core.deps import get_db
+from app.core.response_cache import response_cache
 from app.core.security import verify_bearer_token
+from app.schemas import CacheInvalidation, QueueStatus
 
 router = APIRouter()
 
 
 @router.post("/", summary="Handle new records",
+             status_code=HTTP_202_ACCEPTED,
+             response_model=QueueStatus,
+             dependencies=[Depends(verify_bearer_token)])
+def handle_new_records(settings: BaseSettings = Depends(get_settings)):
+    # records are ingested by worker.py, its watcher finds new records, the request only asks it
+    # for a full scan when it did not do one for RECORDS_FULL_SCAN_INTERVAL_SEC
+    queue = get_settings_job_queue(settings)
+    queue.request_scan(settings.RECORDS_FULL_SCAN_INTERVAL_SEC)
+    depth = queue.depth()
+    oldest_pending_at = queue.oldest_pending_at()
+    return {
+        'depth': depth,
+        'backlog': sum(count for state, count in depth.items() if state not in (JobState.cleaned, JobState.dead)),
+        'oldest_pending_age': time.time() - oldest_pending_at if oldest_pending_at else None,
+        'scheduler': queue.get_status(SCHEDULER_STATUS),
+    }
+
+
+@router.post("/invalidate/", summary="Drop cached records lists of users",
              status_code=HTTP_204_NO_CONTENT,
+             response_class=Response,
              dependencies=[Depends(verify_bearer_token)])
-async def handle_new_records(background_tasks: BackgroundTasks,
-                             settings: BaseSettings = Depends(get_settings),
-                             db: Session = Depends(get_db)):
-    background_tasks.add_task(handle_records, db, settings)
-    return Response(status_code=HTTP_204_NO_CONTENT)
+def invalidate_records_cache(invalidation: CacheInvalidation, settings: BaseSettings = Depends(get_settings)):
+    # the shared generations reach every API process, the pages of this one are freed right away
+    get_settings_job_queue(settings).bump_cache_generations(invalidation.user_ids)
+    response_cache.invalidate(invalidation.user_ids)
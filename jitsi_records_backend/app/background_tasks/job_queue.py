@@ -0,0 +1,208 @@
+import enum
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
+from os.path import join
+
+
+JOB_QUEUE_FILE_NAME = '.records_queue.sqlite3'
+# worker status name of the time the last full scan started
+FULL_SCAN_STATUS = 'full_scan_at'
+
+
+class JobState(str, enum.Enum):
+    pending = 'pending'
+    uploading = 'uploading'
+    uploaded = 'uploaded'
+    recorded = 'recorded'
+    cleaned = 'cleaned'
+    dead = 'dead'
+
+
+# state a job falls back to when its stage fails
+RETRY_STATES = {
+    JobState.pending: JobState.pending,
+    JobState.uploading: JobState.pending,
+    JobState.uploaded: JobState.uploaded,
+    JobState.recorded: JobState.recorded,
+}
+
+Job = namedtuple('Job', ['id', 'dirpath', 'filename', 'state', 'attempts', 'next_attempt_at', 'last_error',
+                         'target_path', 'dead_from', 'created_at', 'updated_at', 'checksum'])
+
+
+class JobQueue:
+    """
+    Durable queue of records being ingested, one job per .mp4 file.
+
+    A job goes pending -> uploading -> uploaded -> recorded -> cleaned. A failed stage is retried
+    with exponential backoff, after `max_attempts` failures the job is moved to the dead-letter state.
+    """
+
+    # seconds a cache generation read waits for a writer before the API bypasses its cache
+    generation_read_timeout = 0.1
+
+    def __init__(self, path, max_attempts=5, backoff_base=30, backoff_max=3600):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._readers = threading.local()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                                 'id INTEGER PRIMARY KEY, '
+                                 'dirpath TEXT NOT NULL, '
+                                 'filename TEXT NOT NULL, '
+                                 'state TEXT NOT NULL, '
+                                 'attempts INTEGER NOT NULL DEFAULT 0, '
+                                 'next_attempt_at REAL NOT NULL DEFAULT 0, '
+                                 'last_error TEXT, '
+                                 'target_path TEXT, '
+                                 'dead_from TEXT, '
+                                 'created_at REAL NOT NULL, '
+                                 'updated_at REAL NOT NULL, '
+                                 'checksum TEXT, '
+                                 'UNIQUE (dirpath, filename))')
+        # queues created before checksums were stored
+        if 'checksum' not in {row[1] for row in self._connection.execute('PRAGMA table_info(jobs)')}:
+            self._connection.execute('ALTER TABLE jobs ADD COLUMN checksum TEXT')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS ix_jobs_state ON jobs (state, next_attempt_at)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS scan_requests ('
+                                 'id INTEGER PRIMARY KEY CHECK (id = 1), '
+                                 'requested_at REAL NOT NULL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS worker_status ('
+                                 'name TEXT PRIMARY KEY, '
+                                 'value TEXT NOT NULL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS cache_generations ('
+                                 'user_id INTEGER PRIMARY KEY, '
+                                 'generation INTEGER NOT NULL)')
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _select(self, where, params=()):
+        return [Job(*row[:3], JobState(row[3]), *row[4:])
+                for row in self._execute(f'SELECT * FROM jobs WHERE {where} ORDER BY id', params)]
+
+    def enqueue(self, dirpath, filename):
+        now = time.time()
+        self._execute('INSERT OR IGNORE INTO jobs (dirpath, filename, state, created_at, updated_at) '
+                      'VALUES (?, ?, ?, ?, ?)', (dirpath, filename, JobState.pending.value, now, now))
+
+    def get_dir_jobs(self, dirpath):
+        return self._select('dirpath = ?', (dirpath,))
+
+    def get_due_jobs(self, dirpaths, now=None):
+        now = time.time() if now is None else now
+        return [job for dirpath in dirpaths for job in self.get_dir_jobs(dirpath)
+                if job.state not in (JobState.cleaned, JobState.dead) and job.next_attempt_at <= now]
+
+    def get_due_dirs(self, now=None):
+        now = time.time() if now is None else now
+        rows = self._execute('SELECT DISTINCT dirpath FROM jobs WHERE state NOT IN (?, ?) AND next_attempt_at <= ?',
+                             (JobState.cleaned.value, JobState.dead.value, now))
+        return {row[0] for row in rows}
+
+    def get_jobs(self, state):
+        return self._select('state = ?', (JobState(state).value,))
+
+    def set_state(self, job, state, target_path=None, checksum=None):
+        state = JobState(state)
+        # a started upload is still the pending stage, its failed attempts count towards max_attempts
+        attempts = job.attempts if state == JobState.uploading else 0
+        self._execute('UPDATE jobs SET state = ?, attempts = ?, next_attempt_at = 0, last_error = NULL, '
+                      'target_path = COALESCE(?, target_path), checksum = COALESCE(?, checksum), updated_at = ? '
+                      'WHERE id = ?',
+                      (state.value, attempts, target_path, checksum, time.time(), job.id))
+
+    def fail(self, job, error, permanent=False):
+        """Schedules the job stage retry, returns the new job state."""
+        attempts = job.attempts + 1
+        now = time.time()
+        retry_state = RETRY_STATES[job.state]
+        if permanent or attempts >= self.max_attempts:
+            state, next_attempt_at = JobState.dead, 0
+        else:
+            state = retry_state
+            next_attempt_at = now + min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        self._execute('UPDATE jobs SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ?, dead_from = ?, '
+                      'updated_at = ? WHERE id = ?',
+                      (state.value, attempts, next_attempt_at, str(error)[:2000],
+                       retry_state.value if state == JobState.dead else None, now, job.id))
+        return state
+
+    def retry_dead(self):
+        """Moves dead-letter jobs back to the stage they failed at."""
+        with self._lock:
+            return self._connection.execute('UPDATE jobs SET state = COALESCE(dead_from, ?), attempts = 0, '
+                                            'next_attempt_at = 0, dead_from = NULL, updated_at = ? WHERE state = ?',
+                                            (JobState.pending.value, time.time(), JobState.dead.value)).rowcount
+
+    def prune(self, older_than):
+        """Forgets cleaned jobs finished more than `older_than` seconds ago."""
+        self._execute('DELETE FROM jobs WHERE state = ? AND updated_at < ?',
+                      (JobState.cleaned.value, time.time() - older_than))
+
+    def depth(self):
+        return {state: count for state, count in self._execute('SELECT state, COUNT(*) FROM jobs GROUP BY state')}
+
+    def oldest_pending_at(self):
+        rows = self._execute('SELECT MIN(created_at) FROM jobs WHERE state NOT IN (?, ?)',
+                             (JobState.cleaned.value, JobState.dead.value))
+        return rows[0][0]
+
+    def request_scan(self, min_interval=0):
+        """
+        Asks the worker to scan the whole records dir, unless it did within `min_interval` seconds.
+
+        Returns whether the scan was requested.
+        """
+        now = time.time()
+        if now - (self.get_status(FULL_SCAN_STATUS) or 0) < min_interval:
+            return False
+        self._execute('INSERT OR REPLACE INTO scan_requests VALUES (1, ?)', (now,))
+        return True
+
+    def pop_scan_request(self):
+        with self._lock:
+            return self._connection.execute('DELETE FROM scan_requests').rowcount > 0
+
+    def set_status(self, name, value):
+        """Publishes a json-serializable worker state for the API."""
+        self._execute('INSERT OR REPLACE INTO worker_status VALUES (?, ?)', (name, json.dumps(value)))
+
+    def get_status(self, name):
+        rows = self._execute('SELECT value FROM worker_status WHERE name = ?', (name,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def bump_cache_generations(self, user_ids):
+        """Marks the cached records lists of the users stale in every API process."""
+        with self._lock:
+            self._connection.executemany('INSERT INTO cache_generations VALUES (?, 1) ON CONFLICT (user_id) '
+                                         'DO UPDATE SET generation = generation + 1',
+                                         [(user_id,) for user_id in user_ids])
+
+    def get_cache_generation(self, user_id):
+        # read on every records list request: a connection per thread, so the read never waits for the queue lock
+        connection = getattr(self._readers, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.generation_read_timeout, isolation_level=None)
+            self._readers.connection = connection
+        rows = connection.execute('SELECT generation FROM cache_generations WHERE user_id = ?', (user_id,)).fetchall()
+        return rows[0][0] if rows else 0
+
+
+@lru_cache()
+def get_job_queue(path, max_attempts=5, backoff_base=30):
+    return JobQueue(path, max_attempts=max_attempts, backoff_base=backoff_base)
+
+
+def get_settings_job_queue(settings):
+    path = settings.RECORDS_QUEUE_PATH or join(settings.RECORDS_DIR, JOB_QUEUE_FILE_NAME)
+    return get_job_queue(path, settings.RECORDS_MAX_ATTEMPTS, settings.RECORDS_RETRY_BACKOFF_SEC)
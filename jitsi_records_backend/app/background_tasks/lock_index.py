@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+# retry_at: when records of a directory whose jobs wait for a retry are due, inf when all of them are dead
+DirState = namedtuple('DirState', ['mtime_ns', 'has_records', 'has_subdirs', 'locked_until', 'retry_at'],
+                      defaults=(None,))
+
+
+class LockIndex:
+    """
+    Directories state remembered between handler runs.
+
+    Lets the handler skip reading directories which are still locked or did not change
+    since the previous run. Kept in memory and written through to sqlite when `path` is given.
+    """
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        self._dirs = {}
+        self._dirty = set()
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS dirs ('
+                                         'dirpath TEXT PRIMARY KEY, '
+                                         'mtime_ns INTEGER, '
+                                         'has_records INTEGER NOT NULL, '
+                                         'has_subdirs INTEGER NOT NULL, '
+                                         'locked_until REAL, '
+                                         'retry_at REAL)')
+                # indexes created before retries were remembered
+                if 'retry_at' not in {row[1] for row in self._connection.execute('PRAGMA table_info(dirs)')}:
+                    self._connection.execute('ALTER TABLE dirs ADD COLUMN retry_at REAL')
+            for dirpath, *state in self._connection.execute('SELECT dirpath, mtime_ns, has_records, has_subdirs, '
+                                                            'locked_until, retry_at FROM dirs'):
+                self._dirs[dirpath] = DirState(state[0], bool(state[1]), bool(state[2]), state[3], state[4])
+
+    def __len__(self):
+        return len(self._dirs)
+
+    def get(self, dirpath):
+        return self._dirs.get(dirpath)
+
+    def set(self, dirpath, state):
+        with self._lock:
+            self._dirs[dirpath] = state
+            self._dirty.add(dirpath)
+
+    def is_locked(self, dirpath, now):
+        state = self._dirs.get(dirpath)
+        return bool(state and state.locked_until and now < state.locked_until)
+
+    def is_unchanged(self, dirpath, mtime_ns, now):
+        """
+        Whether the directory was not modified since the previous run and had nothing to handle,
+        or only records waiting for a retry which is not due yet.
+        """
+        state = self._dirs.get(dirpath)
+        if not state or state.locked_until or state.has_subdirs or state.mtime_ns != mtime_ns:
+            return False
+        return not state.has_records or (state.retry_at is not None and now < state.retry_at)
+
+    def mark_due(self, dirpaths):
+        """Reads the directories on the next run even when unchanged, their jobs are due again."""
+        with self._lock:
+            for dirpath in dirpaths:
+                state = self._dirs.get(dirpath)
+                if state and state.retry_at is not None:
+                    self._dirs[dirpath] = state._replace(retry_at=None)
+                    self._dirty.add(dirpath)
+
+    def forget(self, dirpath):
+        with self._lock:
+            if self._dirs.pop(dirpath, None) is not None:
+                self._dirty.add(dirpath)
+
+    def retain(self, dirpaths):
+        """Forget directories which are gone."""
+        with self._lock:
+            for dirpath in self._dirs.keys() - dirpaths:
+                del self._dirs[dirpath]
+                self._dirty.add(dirpath)
+
+    def commit(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            if self._connection is None or not dirty:
+                return
+            with self._connection:
+                self._connection.executemany('DELETE FROM dirs WHERE dirpath = ?',
+                                             [(dirpath,) for dirpath in dirty if dirpath not in self._dirs])
+                self._connection.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)',
+                                             [(dirpath, *self._dirs[dirpath]) for dirpath in dirty
+                                              if dirpath in self._dirs])
+
+
+@lru_cache()
+def get_lock_index(path=None):
+    return LockIndex(None if path == ':memory:' else path)
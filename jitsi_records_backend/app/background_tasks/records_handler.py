@@ -1,15 +1,25 @@
-import logging
-
 import boto3
 
-from records_handler import parse_dir
-
-logger = logging.getLogger(__name__)
+from app.background_tasks.job_queue import get_settings_job_queue
+from app.background_tasks.lock_index import get_lock_index
+from app.background_tasks.scheduler import get_scheduler
+from app.core.bandwidth import get_limiter
+from app.core.uploader import MB, ResumableUploader, get_s3_client_config
+from records_handler import RecordsHandler
 
 
-def handle_records(db, settings):
-    logger.info("Video records handling started.")
+def get_records_handler(db, settings):
+    scheduler = get_scheduler(settings)
     s3_client = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-    parse_dir(db, s3_client, settings.S3_BUCKET, settings.RECORDS_DIR, settings.STORAGE_HOST)
-    logger.info("Video records handling finished.")
+                             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                             config=get_s3_client_config(scheduler.pool_size, settings.S3_UPLOAD_CONCURRENCY))
+    uploader = ResumableUploader(s3_client, settings.S3_BUCKET,
+                                 part_size=settings.S3_UPLOAD_PART_SIZE_MB * MB,
+                                 concurrency=settings.S3_UPLOAD_CONCURRENCY,
+                                 limiter=get_limiter(settings.S3_UPLOAD_LIMIT_MB, settings.S3_UPLOAD_LIMIT_SCHEDULE))
+    lock_index = get_lock_index(settings.RECORDS_LOCK_INDEX) if settings.RECORDS_LOCK_INDEX else None
+    return RecordsHandler(db, s3_client, settings.S3_BUCKET, settings.RECORDS_DIR, settings.STORAGE_HOST,
+                          get_settings_job_queue(settings), settings.RECORDS_UPLOAD_WORKERS, uploader,
+                          lock_index, settings.RECORDS_LEASE_TIMEOUT_MIN, settings.RECORDS_INSERT_BATCH_SIZE,
+                          settings.RECORDS_API_URL, settings.RECORDS_HANDLER_TOKEN, scheduler,
+                          settings.RECORDS_FASTSTART)
@@ -0,0 +1,136 @@
+import logging
+import os
+import time
+from os.path import join
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # not available outside of linux
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+RECORD_EXTENSION = '.mp4'
+
+
+class InotifyWatcher:
+    """
+    Reports directories where jibri has just closed an .mp4 file.
+
+    `None` in the reported batch means events were lost and the whole records dir should be scanned.
+    """
+    def __init__(self, records_dir, read_delay=1):
+        self.records_dir = records_dir
+        self.read_delay = read_delay
+        self.inotify = INotify()
+        self.watches = {}
+        self.add_watch(records_dir)
+
+    def add_watch(self, dirpath):
+        for path, _, __ in os.walk(dirpath):
+            try:
+                wd = self.inotify.add_watch(path, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+            except OSError as exc:
+                logger.warning(f"Can't watch {path}: {exc}")
+                continue
+            self.watches[wd] = path
+
+    def iter_changes(self, timeout=None):
+        """Yields changed directories, an empty set is yielded every `timeout` seconds without changes."""
+        while True:
+            changed = set()
+            events = self.inotify.read(timeout=None if timeout is None else timeout * 1000,
+                                       read_delay=self.read_delay * 1000)
+            for event in events:
+                if event.mask & flags.Q_OVERFLOW:
+                    logger.warning("Inotify queue overflowed, rescanning records dir.")
+                    changed.add(None)
+                    continue
+                if event.mask & flags.IGNORED:
+                    self.watches.pop(event.wd, None)
+                    continue
+                dirpath = self.watches.get(event.wd)
+                if dirpath is None:
+                    continue
+                if event.mask & flags.ISDIR:
+                    # files could be closed before the watch was added
+                    self.add_watch(join(dirpath, event.name))
+                    changed.add(join(dirpath, event.name))
+                elif event.name.endswith(RECORD_EXTENSION) and event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    changed.add(dirpath)
+            if changed or timeout is not None:
+                yield changed
+
+    def close(self):
+        self.inotify.close()
+
+
+class PollingWatcher:
+    """
+    Fallback for systems without inotify.
+
+    Only directories whose mtime changed since the previous poll are listed,
+    a record is reported once it was not modified for `settle` seconds.
+    """
+
+    def __init__(self, records_dir, poll_interval=10, settle=None):
+        self.records_dir = records_dir
+        self.poll_interval = poll_interval
+        self.settle = poll_interval if settle is None else settle
+        self.mtimes = {}
+        self.unsettled = set()
+        # remember the current state, the initial full scan is done by the caller
+        self.poll()
+        self.unsettled.clear()
+
+    def poll(self):
+        changed = set()
+        seen = {}
+        try:
+            entries = [self.records_dir] + [entry.path for entry in os.scandir(self.records_dir) if entry.is_dir()]
+        except OSError as exc:
+            logger.warning(f"Can't list {self.records_dir}: {exc}")
+            return changed
+        for dirpath in entries:
+            try:
+                seen[dirpath] = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            if self.mtimes.get(dirpath) != seen[dirpath]:
+                self.unsettled.add(dirpath)
+        self.mtimes = seen
+        self.unsettled &= seen.keys()
+
+        now = time.time()
+        for dirpath in list(self.unsettled):
+            try:
+                records = [entry for entry in os.scandir(dirpath)
+                           if entry.name.endswith(RECORD_EXTENSION) and entry.is_file()]
+            except OSError:
+                self.unsettled.discard(dirpath)
+                continue
+            if any(now - entry.stat().st_mtime < self.settle for entry in records):
+                continue
+            self.unsettled.discard(dirpath)
+            if records:
+                changed.add(dirpath)
+        return changed
+
+    def iter_changes(self, timeout=None):
+        while True:
+            time.sleep(self.poll_interval if timeout is None else min(self.poll_interval, timeout))
+            changed = self.poll()
+            if changed or timeout is not None:
+                yield changed
+
+    def close(self):
+        pass
+
+
+def get_watcher(records_dir, poll_interval=10):
+    if INotify is not None:
+        try:
+            return InotifyWatcher(records_dir)
+        except OSError as exc:
+            logger.warning(f"Inotify is not available ({exc}), falling back to polling.")
+    return PollingWatcher(records_dir, poll_interval)
@@ -0,0 +1,168 @@
+import enum
+import os
+import shutil
+import time
+from os.path import join
+
+from app.background_tasks.records_watcher import RECORD_EXTENSION
+
+# JobQueue status name of the last scheduler decisions
+SCHEDULER_STATUS = 'scheduler'
+
+
+class SchedulePolicy(str, enum.Enum):
+    oldest = 'oldest'
+    largest = 'largest'
+    # directories which free the most disk space per byte still to upload go first
+    most_bytes_soonest = 'most_bytes_soonest'
+
+
+class DiskPressureScheduler:
+    """
+    Orders records uploads and picks how many run at once.
+
+    Jibri records into the same volume, so a full disk fails live recordings. Below `low_free_percent`
+    of free space the upload workers are raised to `pressure_workers`. While jibri is writing an .mp4,
+    one modified within `recording_active_sec` which is not being uploaded, they are lowered to
+    `recording_workers` and parts are sent one at a time to leave it CPU and disk bandwidth.
+    Disk pressure wins over an active recording.
+    """
+
+    def __init__(self, records_dir, policy=SchedulePolicy.oldest, max_workers=4, pressure_workers=8,
+                 recording_workers=1, low_free_percent=15, recording_active_sec=30, check_interval=5):
+        self.records_dir = records_dir
+        self.policy = SchedulePolicy(policy)
+        self.max_workers = max(1, max_workers)
+        self.pressure_workers = max(self.max_workers, pressure_workers)
+        self.recording_workers = max(1, recording_workers)
+        self.low_free_percent = low_free_percent
+        self.recording_active_sec = recording_active_sec
+        self.check_interval = check_interval
+        self.pending_bytes = 0
+        self.under_pressure = False
+        self.recording = False
+        self.throttled = False
+        self._remaining = {}
+        self._scheduled = set()
+        self._recording_checked_at = None
+
+    @property
+    def pool_size(self):
+        return self.pressure_workers
+
+    def disk_usage(self):
+        usage = shutil.disk_usage(self.records_dir)
+        return usage.free, usage.total
+
+    def free_percent(self):
+        free, total = self.disk_usage()
+        return free / total * 100 if total else 100
+
+    def is_recording(self):
+        """Whether jibri is writing a record, checked at most every `check_interval` seconds."""
+        now = time.monotonic()
+        if self._recording_checked_at is not None and now < self._recording_checked_at + self.check_interval:
+            return self.recording
+        active_after = time.time() - self.recording_active_sec
+        self.recording = any(mtime > active_after for path, mtime in self._iter_records_mtimes()
+                             if path not in self._scheduled)
+        self._recording_checked_at = now
+        return self.recording
+
+    def _iter_records_mtimes(self):
+        # jibri writes every recording into its own directory right under the records dir
+        try:
+            with os.scandir(self.records_dir) as entries:
+                dirpaths = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            return
+        for dirpath in dirpaths:
+            try:
+                with os.scandir(dirpath) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(RECORD_EXTENSION):
+                            yield entry.path, entry.stat().st_mtime
+            except OSError:
+                continue
+
+    def workers(self):
+        """Number of uploads to run now, also sets `under_pressure`, `recording` and `throttled`."""
+        self.under_pressure = self.free_percent() < self.low_free_percent
+        recording = self.is_recording()
+        self.throttled = recording and not self.under_pressure
+        if self.under_pressure:
+            return self.pressure_workers
+        if self.throttled:
+            return self.recording_workers
+        return self.max_workers
+
+    def order(self, jobs, uploaded_bytes=None):
+        """
+        Returns jobs in the upload order of the policy and sets `pending_bytes` to what is left to upload.
+
+        `uploaded_bytes(filename, size)` tells how much of a file an interrupted upload already sent.
+        """
+        sizes, mtimes, remaining = {}, {}, {}
+        self._scheduled = set()
+        for job in jobs:
+            filename = join(job.dirpath, job.filename)
+            self._scheduled.add(filename)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                # the upload fails and retries it
+                sizes[job.id], mtimes[job.id], remaining[job.id] = 0, 0, 0
+                continue
+            sizes[job.id], mtimes[job.id] = stat.st_size, stat.st_mtime
+            remaining[job.id] = stat.st_size - (uploaded_bytes(filename, stat.st_size) if uploaded_bytes else 0)
+        self._remaining = remaining
+        self.pending_bytes = sum(remaining.values())
+
+        if self.policy == SchedulePolicy.oldest:
+            return sorted(jobs, key=lambda job: (mtimes[job.id], job.id))
+        if self.policy == SchedulePolicy.largest:
+            return sorted(jobs, key=lambda job: (-sizes[job.id], job.id))
+        # a directory is freed once all its records are uploaded, so its jobs go together
+        dir_cost = {}
+        for job in jobs:
+            dir_cost[job.dirpath] = dir_cost.get(job.dirpath, 0) + remaining[job.id]
+        dir_freed = {dirpath: self._dir_size(dirpath) for dirpath in dir_cost}
+        return sorted(jobs, key=lambda job: (-dir_freed[job.dirpath] / max(dir_cost[job.dirpath], 1),
+                                             -dir_freed[job.dirpath], job.dirpath, job.id))
+
+    def done(self, job):
+        """Takes a finished or failed upload out of `pending_bytes`."""
+        self.pending_bytes -= self._remaining.pop(job.id, 0)
+
+    @staticmethod
+    def _dir_size(dirpath):
+        size = 0
+        for path, _, filenames in os.walk(dirpath):
+            for filename in filenames:
+                try:
+                    size += os.stat(join(path, filename)).st_size
+                except OSError:
+                    continue
+        return size
+
+    def status(self, workers, in_flight=0):
+        free, total = self.disk_usage()
+        return {
+            'policy': self.policy.value,
+            'free_bytes': free,
+            'free_percent': round(free / total * 100, 2) if total else None,
+            'under_pressure': self.under_pressure,
+            'recording': self.recording,
+            'throttled': self.throttled,
+            'workers': workers,
+            'in_flight': in_flight,
+            'pending_bytes': self.pending_bytes,
+            'updated_at': time.time(),
+        }
+
+
+def get_scheduler(settings):
+    return DiskPressureScheduler(settings.RECORDS_DIR, settings.RECORDS_SCHEDULE_POLICY,
+                                 settings.RECORDS_UPLOAD_WORKERS, settings.RECORDS_PRESSURE_UPLOAD_WORKERS,
+                                 settings.RECORDS_RECORDING_UPLOAD_WORKERS, settings.RECORDS_LOW_FREE_PERCENT,
+                                 settings.RECORDS_RECORDING_ACTIVE_SEC)
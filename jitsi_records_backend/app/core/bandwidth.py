@@ -0,0 +1,108 @@
+import io
+import threading
+import time
+from datetime import datetime
+
+from app.core.metrics import upload_throttled_seconds
+from app.core.uploader import MB
+
+# bytes a throttled body sends between token checks
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_schedule(schedule):
+    """
+    Parses `HH:MM-HH:MM=<MB/s>` windows separated by commas into (start, end, bytes per second) in minutes of the day.
+
+    A window may wrap midnight, `0` means no limit. Raises ValueError for a malformed schedule.
+    """
+    windows = []
+    for window in filter(None, (part.strip() for part in (schedule or '').split(','))):
+        try:
+            period, limit = window.split('=')
+            start, end = (datetime.strptime(value.strip(), '%H:%M') for value in period.split('-'))
+            limit = float(limit)
+        except ValueError:
+            raise ValueError(f"Malformed upload limit window {window!r}, expected HH:MM-HH:MM=<MB/s>.")
+        if limit < 0:
+            raise ValueError(f"Negative upload limit in {window!r}.")
+        windows.append((start.hour * 60 + start.minute, end.hour * 60 + end.minute, limit * MB or None))
+    return windows
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by all uploads of the process, refilled at the limit of the current time of day.
+
+    The limit is `windows` (see parse_schedule) at the local time of the host, `limit` outside of them,
+    None runs at full speed. Senders take tokens before every chunk and sleep off a deficit, so the
+    concurrent uploads together stay within the limit and the bucket holds at most one second of it.
+    """
+
+    def __init__(self, limit=None, windows=(), clock=time.monotonic, now=datetime.now):
+        self.limit = limit or None
+        self.windows = list(windows)
+        self.clock = clock
+        self.now = now
+        self.throttled_sec = 0.0
+        self._tokens = 0.0
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.limit or any(limit for _, _, limit in self.windows))
+
+    def rate(self):
+        """Bytes per second allowed now, None for no limit."""
+        now = self.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, limit in self.windows:
+            if start <= minute < end or (end <= start and (minute >= start or minute < end)):
+                return limit
+        return self.limit
+
+    def consume(self, amount):
+        rate = self.rate()
+        with self._lock:
+            now = self.clock()
+            if rate is None:
+                self._tokens, self._updated_at = 0.0, now
+                return 0
+            self._tokens = min(rate, self._tokens + (now - self._updated_at) * rate) - amount
+            self._updated_at = now
+            delay = -self._tokens / rate if self._tokens < 0 else 0
+            self.throttled_sec += delay
+        if delay:
+            upload_throttled_seconds.inc(delay)
+            time.sleep(delay)
+        return delay
+
+    def body(self, data):
+        """Wraps a request body so sending it takes tokens, the body is sent as is without a limit."""
+        return ThrottledBody(data, self) if self.enabled else data
+
+
+class ThrottledBody(io.BytesIO):
+    # a seekable file object, so botocore can rewind it for a retry, which takes tokens again
+    def __init__(self, data, limiter):
+        super().__init__(data)
+        self.limiter = limiter
+
+    def read(self, size=-1):
+        chunks = []
+        while size is None or size < 0 or size > 0:
+            chunk = super().read(CHUNK_SIZE if size is None or size < 0 else min(size, CHUNK_SIZE))
+            if not chunk:
+                break
+            self.limiter.consume(len(chunk))
+            chunks.append(chunk)
+            if size is not None and size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+
+def get_limiter(limit_mb=0, schedule=None):
+    """Limiter of S3_UPLOAD_LIMIT_MB and S3_UPLOAD_LIMIT_SCHEDULE, None when neither limits uploads."""
+    limiter = BandwidthLimiter(limit_mb * MB, parse_schedule(schedule))
+    return limiter if limiter.enabled else None
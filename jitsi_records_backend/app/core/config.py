@@ -17,18 +17,77 @@ class BaseSettings(PydanticSettings):
     ALLOW_ORIGINS: Union[str, list[str]] = None
     RECORDS_HANDLER_TOKEN: str
     RECORDS_DIR: str
+    RECORDS_UPLOAD_WORKERS: int = 4
+    # sqlite file (or ':memory:') to remember records dirs state between runs
+    RECORDS_LOCK_INDEX: Optional[str] = None
+    # a records dir claim is taken over by another handler if it was not renewed for this time
+    RECORDS_LEASE_TIMEOUT_MIN: int = 5
+    # ingestion jobs sqlite file, RECORDS_DIR/.records_queue.sqlite3 by default
+    RECORDS_QUEUE_PATH: Optional[str] = None
+    RECORDS_MAX_ATTEMPTS: int = 5
+    RECORDS_RETRY_BACKOFF_SEC: int = 30
+    RECORDS_INSERT_BATCH_SIZE: int = 100
+    RECORDS_WATCH_POLL_INTERVAL: int = 10
+    # POST /api/records-handler/ asks the worker for a full scan at most this often, the watcher finds new records
+    RECORDS_FULL_SCAN_INTERVAL_SEC: int = 3600
+    # upload order: oldest, largest or most_bytes_soonest (directories freeing the most space per uploaded byte)
+    RECORDS_SCHEDULE_POLICY: str = 'oldest'
+    # below this free space of RECORDS_DIR uploads run on RECORDS_PRESSURE_UPLOAD_WORKERS
+    RECORDS_LOW_FREE_PERCENT: float = 15
+    RECORDS_PRESSURE_UPLOAD_WORKERS: int = 8
+    # while jibri is recording, a record modified within RECORDS_RECORDING_ACTIVE_SEC, uploads are throttled
+    RECORDS_RECORDING_UPLOAD_WORKERS: int = 1
+    RECORDS_RECORDING_ACTIVE_SEC: int = 30
+    # move the moov box of records to the front before upload, so playback starts without reading the file end
+    RECORDS_FASTSTART: bool = False
     S3_BUCKET: str
+    S3_UPLOAD_PART_SIZE_MB: int = 16
+    S3_UPLOAD_CONCURRENCY: int = 4
+    # MB/s all uploads of the worker share, 0 is no limit
+    S3_UPLOAD_LIMIT_MB: float = 0
+    # limits by local time overriding S3_UPLOAD_LIMIT_MB, e.g. 08:00-20:00=2,20:00-23:00=10
+    S3_UPLOAD_LIMIT_SCHEDULE: Optional[str] = None
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
     PRESIGNED_URL_EXPIRES_IN: int = 3600
+    # cached presigned urls are reused until this many seconds before they expire
+    PRESIGNED_URL_REFRESH_MARGIN: int = 300
+    PRESIGNED_URL_CACHE_SIZE: int = 10000
+    # records list count=approximate stops counting here
+    RECORDS_COUNT_CAP: int = 1000
+    # records list pages are cached per user for at most half of PRESIGNED_URL_REFRESH_MARGIN
+    RECORDS_RESPONSE_CACHE_TTL: int = 60
+    RECORDS_RESPONSE_CACHE_SIZE: int = 10000
+    # the worker asks the API to drop cached pages of users whose records were saved
+    RECORDS_API_URL: Optional[str] = None
+    # /metrics requires this bearer token when set
+    METRICS_TOKEN: Optional[str] = None
+    # adds a Server-Timing header with the stages of each request
+    METRICS_SERVER_TIMING: bool = False
+    # the worker serves /metrics on this port, 0 disables it
+    METRICS_PORT: int = 0
     STORAGE_HOST: str
     GREYT_HOST: str
+    # validated tokens are trusted for this long, so a revoked token keeps working until it expires from the cache
+    GREYT_TOKEN_CACHE_TTL: int = 60
+    GREYT_TOKEN_NEGATIVE_CACHE_TTL: int = 10
+    GREYT_TOKEN_CACHE_SIZE: int = 10000
+    HTTP_POOL_SIZE: int = 100
+    HTTP_KEEPALIVE_TIMEOUT: int = 30
+    HTTP_CONNECT_TIMEOUT: float = 3
+    HTTP_TIMEOUT: float = 10
     DB_HOST: str
     DB_PORT: str = None
     DB_USERNAME: str
     DB_PASSWORD: str
     DB_DATABASE: str
     SQLALCHEMY_DATABASE_URI: Optional[str] = None
+    # async driver url for the API, derived from SQLALCHEMY_DATABASE_URI by default
+    SQLALCHEMY_ASYNC_DATABASE_URI: Optional[str] = None
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
 
     @field_validator("ALLOW_ORIGINS", mode="before")
     @classmethod
@@ -60,6 +119,19 @@ class BaseSettings(PydanticSettings):
         db = values.get("DB_DATABASE")
         return f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}"
 
+    @field_validator("SQLALCHEMY_ASYNC_DATABASE_URI", mode="before")
+    @classmethod
+    def assemble_async_db_connection(cls, v: Optional[str], info) -> Any:
+        if isinstance(v, str):
+            return v
+        uri = info.data.get("SQLALCHEMY_DATABASE_URI") or ""
+        for sync_driver, async_driver in (("mysql+pymysql://", "mysql+aiomysql://"),
+                                          ("mysql://", "mysql+aiomysql://"),
+                                          ("sqlite://", "sqlite+aiosqlite://")):
+            if uri.startswith(sync_driver):
+                return async_driver + uri[len(sync_driver):]
+        return uri
+
     def get_fast_api_init_keys(self) -> dict:
         return {
             k: v
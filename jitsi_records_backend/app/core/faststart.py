@@ -0,0 +1,213 @@
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import time
+from os.path import join, split
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# the moov atom indexes every sample, a recording with a larger one is not an mp4 from jibri
+MAX_MOOV_SIZE = 256 * 1024 * 1024
+MAX_UINT32 = 2 ** 32 - 1
+# stco keeps 32 bit chunk offsets, co64 64 bit ones
+MAX_STCO_OFFSET = MAX_UINT32
+# boxes on the path to the chunk offset tables
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class FaststartError(Exception):
+    pass
+
+
+def iter_boxes(f, end):
+    """Yields (type, offset, header size, size) of top level boxes from the current position of `f` up to `end`."""
+    offset = f.tell()
+    while offset < end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise FaststartError(f"Truncated box header at {offset}.")
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack('>Q', f.read(8))
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise FaststartError(f"Malformed {box_type!r} box at {offset}.")
+        yield box_type, offset, header_size, size
+        offset += size
+
+
+def _box(box_type, payload):
+    if len(payload) + 8 > MAX_UINT32:
+        return struct.pack('>I4sQ', 1, box_type, len(payload) + 16) + payload
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def _rebuild(box_type, payload, move, co64):
+    """Rebuilds a moov box with chunk offsets mapped by `move`, stco tables become co64 with `co64`."""
+    if box_type in CONTAINERS:
+        children, offset = [], 0
+        while offset < len(payload):
+            size, child_type = struct.unpack_from('>I4s', payload, offset)
+            header_size = 8
+            if size == 1:
+                size, = struct.unpack_from('>Q', payload, offset + 8)
+                header_size = 16
+            elif size == 0:
+                size = len(payload) - offset
+            if size < header_size or offset + size > len(payload):
+                raise FaststartError(f"Malformed {child_type!r} box inside {box_type!r}.")
+            children.append(_rebuild(child_type, payload[offset + header_size:offset + size], move, co64))
+            offset += size
+        return _box(box_type, b''.join(children))
+    if box_type in (b'stco', b'co64'):
+        version_flags, count = struct.unpack_from('>4sI', payload)
+        entry_format = '>I' if box_type == b'stco' else '>Q'
+        entries = payload[8:8 + count * struct.calcsize(entry_format)]
+        offsets = [move(offset) for offset, in struct.iter_unpack(entry_format, entries)]
+        if box_type == b'co64' or co64:
+            return _box(b'co64', version_flags + struct.pack(f'>I{count}Q', count, *offsets))
+        if offsets and max(offsets) > MAX_STCO_OFFSET:
+            raise OverflowError
+        return _box(b'stco', version_flags + struct.pack(f'>I{count}I', count, *offsets))
+    if box_type == b'cmov':
+        raise FaststartError("Compressed moov is not supported.")
+    return _box(box_type, payload)
+
+
+def _copy_range(src, dst, offset, length):
+    src.seek(offset)
+    while length:
+        chunk = src.read(min(length, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise FaststartError("Record file ended while copying.")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+def relocate_moov(src_path, dst_path):
+    """
+    Writes `src_path` to `dst_path` with the moov box in front of the media data.
+
+    Returns the size of the written file, 0 when moov already is in front and nothing was written.
+
+    Boxes are copied as they are in chunks, only moov is read into memory, with its chunk offsets moved
+    by the new position of the media data.
+    """
+    with open(src_path, 'rb') as src:
+        end = os.fstat(src.fileno()).st_size
+        boxes = list(iter_boxes(src, end))
+        moov = next((box for box in boxes if box[0] == b'moov'), None)
+        mdat = next((box for box in boxes if box[0] == b'mdat'), None)
+        if moov is None:
+            raise FaststartError("No moov box.")
+        if mdat is None or moov[1] < mdat[1]:
+            return 0
+        _, moov_offset, header_size, moov_size = moov
+        if moov_size > MAX_MOOV_SIZE:
+            raise FaststartError(f"moov box of {moov_size} bytes is too large.")
+        src.seek(moov_offset + header_size)
+        payload = src.read(moov_size - header_size)
+
+        insert_at, moov_end = mdat[1], moov_offset + moov_size
+        for co64 in (False, True):
+            # the size does not depend on the offsets, only on the stco -> co64 conversion
+            new_size = len(_rebuild(b'moov', payload, lambda offset: 0, co64))
+
+            def move(offset):
+                if offset >= moov_end:
+                    return offset - moov_size + new_size
+                return offset + new_size if offset >= insert_at else offset
+            try:
+                new_moov = _rebuild(b'moov', payload, move, co64)
+                break
+            except OverflowError:
+                continue
+
+        with open(dst_path, 'wb') as dst:
+            _copy_range(src, dst, 0, insert_at)
+            dst.write(new_moov)
+            _copy_range(src, dst, insert_at, moov_offset - insert_at)
+            _copy_range(src, dst, moov_end, end - moov_end)
+    return end - moov_size + len(new_moov)
+
+
+def ffmpeg_faststart(src_path, dst_path):
+    subprocess.run(['ffmpeg', '-v', 'error', '-nostdin', '-y', '-i', src_path, '-map', '0', '-c', 'copy',
+                    '-movflags', '+faststart', '-f', 'mp4', dst_path], check=True, capture_output=True)
+
+
+def _media_size(boxes):
+    return sum(size - header_size for box_type, _, header_size, size in boxes if box_type == b'mdat')
+
+
+def check_rewrite(src_path, dst_path, size=None):
+    """
+    Raises FaststartError unless `dst_path` is a complete rewrite of `src_path` with moov in front.
+
+    The rewrite must parse to its end, have moov before mdat, the media data of the source
+    and `size` bytes when given.
+    """
+    with open(src_path, 'rb') as src:
+        src_boxes = list(iter_boxes(src, os.fstat(src.fileno()).st_size))
+    with open(dst_path, 'rb') as dst:
+        end = os.fstat(dst.fileno()).st_size
+        dst_boxes = list(iter_boxes(dst, end))
+    if size is not None and end != size:
+        raise FaststartError(f"Rewrite has {end} bytes, {size} expected.")
+    box_types = [box[0] for box in dst_boxes]
+    if b'moov' not in box_types or b'mdat' not in box_types or box_types.index(b'moov') > box_types.index(b'mdat'):
+        raise FaststartError("Rewrite has no moov in front of the media data.")
+    if _media_size(dst_boxes) != _media_size(src_boxes):
+        raise FaststartError(f"Rewrite has {_media_size(dst_boxes)} bytes of media data, "
+                             f"{_media_size(src_boxes)} expected.")
+
+
+def faststart(filename, settle_sec=0):
+    """
+    Moves the moov box of a record to the front in place, so players start without fetching the end of the file.
+
+    Falls back to a local ffmpeg for files the box parser does not handle. The record is replaced only by
+    a rewrite which passes `check_rewrite`. Returns whether the file was rewritten, a file which can't be
+    rewritten or was modified within `settle_sec`, jibri may still be writing it, is left as it is.
+    """
+    dirpath, name = split(filename)
+    tmp_path = join(dirpath, f'.{name}.faststart.tmp')
+    try:
+        if time.time() - os.path.getmtime(filename) < settle_sec:
+            logger.warning(f"Not moving moov of {filename} to the front, it was modified within {settle_sec}s.")
+            return False
+        try:
+            size = relocate_moov(filename, tmp_path)
+            if not size:
+                return False
+        except FaststartError as exc:
+            if not shutil.which('ffmpeg'):
+                logger.warning(f"Can't move moov of {filename} to the front: {exc}")
+                return False
+            logger.info(f"Moving moov of {filename} to the front with ffmpeg: {exc}")
+            ffmpeg_faststart(filename, tmp_path)
+            size = None
+        check_rewrite(filename, tmp_path, size)
+        shutil.copymode(filename, tmp_path)
+        os.replace(tmp_path, filename)
+        return True
+    except FaststartError as exc:
+        logger.warning(f"Not replacing {filename}, its rewrite with moov in front is invalid: {exc}")
+        return False
+    except subprocess.CalledProcessError as exc:
+        logger.warning(f"ffmpeg failed to move moov of {filename} to the front: {exc.stderr.decode()[-2000:]}")
+        return False
+    except OSError as exc:
+        # e.g. no space for the copy, the record is uploaded as it is
+        logger.warning(f"Can't move moov of {filename} to the front: {exc}")
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -1,11 +1,18 @@
 import aiohttp
 
+from app.core.config import get_settings
+
 
 class HttpClient:
     session: aiohttp.ClientSession = None
 
     def start(self):
-        self.session = aiohttp.ClientSession()
+        settings = get_settings()
+        connector = aiohttp.TCPConnector(limit=settings.HTTP_POOL_SIZE,
+                                         keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+                                         ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
 
     async def stop(self):
         await self.session.close()
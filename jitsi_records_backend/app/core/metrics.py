@@ -0,0 +1,182 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+import prometheus_client
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+# seconds, from a cached token check to a multi-GB upload
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def is_multiprocess():
+    # set by prestart.sh for the gunicorn workers of the API, every worker writes its values to files there
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+callback_gauges = []
+
+
+class CallbackGauge:
+    """
+    Gauge read on every scrape, `set_function` returns a number, or a dict of label values tuples to numbers.
+
+    The value is read by the process which answers the scrape, so it must be the same in all of them,
+    e.g. read from the job queue. Nothing is reported while the function is unset or returns None.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._function = None
+        callback_gauges.append(self)
+        if not is_multiprocess():
+            REGISTRY.register(self)
+
+    def set_function(self, function: Callable):
+        self._function = function
+
+    def collect(self):
+        if self._function is None:
+            return []
+        try:
+            values = self._function()
+        except Exception as exc:
+            logger.warning(f"Failed to collect {self.name}: {exc}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        family = GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        for key, value in sorted(values.items()):
+            family.add_metric([str(label) for label in key], value)
+        return [family]
+
+
+def get_registry():
+    """Registry of this process, or one merging the files of all processes in multiprocess mode."""
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for gauge in callback_gauges:
+        registry.register(gauge)
+    return registry
+
+
+def render() -> bytes:
+    return prometheus_client.generate_latest(get_registry())
+
+
+# records API
+http_request_seconds = Histogram(
+    'records_http_request_seconds', 'Time to handle an API request.', ('method', 'route', 'status'),
+    buckets=DEFAULT_BUCKETS)
+api_stage_seconds = Histogram(
+    'records_api_stage_seconds', 'Time spent in a stage of GET /api/records/.', ('stage',), buckets=DEFAULT_BUCKETS)
+response_cache_requests = Counter(
+    'records_api_response_cache_total', 'Records list pages served from or missing in the response cache.',
+    ('result',))
+# ingestion, the worker is a single process, its gauges keep the most recent value in multiprocess mode too
+ingest_stage_seconds = Histogram(
+    'records_ingest_stage_seconds', 'Time spent in a stage of handling records.', ('stage',), buckets=DEFAULT_BUCKETS)
+uploaded_records = Counter('records_uploaded_total', 'Records uploaded to the bucket.')
+uploaded_bytes = Counter('records_uploaded_bytes_total', 'Bytes of records uploaded to the bucket.')
+failed_records = Counter('records_failed_total', 'Failed record jobs attempts.')
+backlog = CallbackGauge('records_backlog', 'Record jobs in the queue by state.', ('state',))
+oldest_pending_age = CallbackGauge(
+    'records_oldest_pending_age_seconds', 'Age of the oldest record job not cleaned yet.')
+disk_free_bytes = Gauge('records_disk_free_bytes', 'Free space of the records dir volume.',
+                        multiprocess_mode='mostrecent')
+pending_bytes = Gauge('records_pending_bytes', 'Bytes of records left to upload in this run.',
+                      multiprocess_mode='mostrecent')
+upload_workers = Gauge('records_upload_workers', 'Uploads the scheduler lets run at once.',
+                       multiprocess_mode='mostrecent')
+disk_pressure = Gauge('records_disk_pressure', '1 while free space is below the threshold.',
+                      multiprocess_mode='mostrecent')
+jibri_recording = Gauge('records_jibri_recording', '1 while jibri is writing a record.',
+                        multiprocess_mode='mostrecent')
+upload_limit = CallbackGauge(
+    'records_upload_limit_bytes_per_second', 'Upload bandwidth limit of the current time of day, absent without one.')
+upload_throttled_seconds = Counter(
+    'records_upload_throttled_seconds_total', 'Time uploads waited for the bandwidth limit.')
+
+# spans of the current request, set by MetricsMiddleware when Server-Timing is on
+_spans: ContextVar[Optional[list]] = ContextVar('metrics_spans', default=None)
+
+
+@contextmanager
+def timed(histogram: Histogram, stage: str):
+    """Observes the block time in `histogram` under `stage`, and as a Server-Timing span of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.labels(stage=stage).observe(elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def watch_job_queue(get_queue: Callable):
+    """Reports backlog and oldest pending age of the queue returned by `get_queue` on every scrape."""
+    backlog.set_function(lambda: {(state,): count for state, count in get_queue().depth().items()})
+
+    def get_oldest_pending_age():
+        oldest_pending_at = get_queue().oldest_pending_at()
+        return time.time() - oldest_pending_at if oldest_pending_at else 0
+    oldest_pending_age.set_function(get_oldest_pending_age)
+
+
+class MetricsMiddleware:
+    """
+    Observes request time per route, with `server_timing` adds the stage spans as a Server-Timing header.
+    """
+
+    def __init__(self, app, server_timing=False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+        spans = []
+        token = _spans.set(spans) if self.server_timing else None
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                if self.server_timing:
+                    spans.append(('total', time.perf_counter() - started))
+                    header = ', '.join(f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in spans)
+                    message.setdefault('headers', [])
+                    message['headers'] = list(message['headers']) + [(b'server-timing', header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if token is not None:
+                _spans.reset(token)
+            # the API routes have no path parameters, so a matched path is its route,
+            # unknown paths are counted together to keep the label set small
+            route = scope['path'] if 'route' in scope else 'unmatched'
+            http_request_seconds.labels(method=scope['method'], route=route, status=status[0]) \
+                .observe(time.perf_counter() - started)
+
+
+def start_http_server(port: int, addr: str = '0.0.0.0'):
+    """Serves the metrics on /metrics from a daemon thread, for processes without the API app."""
+    return prometheus_client.start_http_server(port, addr, registry=get_registry())
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app.core.config import get_settings
+
+
+class Presigner:
+    """
+    Presigned GET urls of the records bucket.
+
+    The S3 client is created once and shared by all requests (botocore clients are thread-safe).
+    Urls are cached per key and handed out again until `refresh_margin` seconds before they expire,
+    the cache keeps at most `maxsize` least recently used urls.
+    """
+
+    def __init__(self, maxsize=10000, refresh_margin=300):
+        self.maxsize = maxsize
+        self.refresh_margin = refresh_margin
+        self._s3_client = None
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            with self._lock:
+                if self._s3_client is None:
+                    # boto3 takes a good part of the API import time, it is loaded by the first presigned url
+                    import boto3
+                    from botocore.client import Config
+
+                    settings = get_settings()
+                    session = boto3.session.Session(aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                                                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
+                    self._s3_client = session.client('s3', region_name='eu-central-1',
+                                                     config=Config(signature_version='s3v4'))
+        return self._s3_client
+
+    def __call__(self, key: str) -> str:
+        settings = get_settings()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._urls.get(key)
+            if cached is not None and now < cached[1]:
+                self._urls.move_to_end(key)
+                return cached[0]
+        url = self.s3_client.generate_presigned_url('get_object', Params={'Bucket': settings.S3_BUCKET, 'Key': key},
+                                                    ExpiresIn=settings.PRESIGNED_URL_EXPIRES_IN, HttpMethod='GET')
+        reuse_for = settings.PRESIGNED_URL_EXPIRES_IN - min(self.refresh_margin, settings.PRESIGNED_URL_EXPIRES_IN)
+        with self._lock:
+            self._urls[key] = url, now + reuse_for
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.maxsize:
+                self._urls.popitem(last=False)
+        return url
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+presigner = Presigner(maxsize=get_settings().PRESIGNED_URL_CACHE_SIZE,
+                      refresh_margin=get_settings().PRESIGNED_URL_REFRESH_MARGIN)
@@ -0,0 +1,110 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Optional, Tuple
+
+from app.background_tasks.job_queue import get_settings_job_queue
+from app.core.config import get_settings
+from app.core.presigner import presigner
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Rendered records list pages per user with their ETags.
+
+    Entries live for `ttl` seconds at most and are dropped when the records of their user change.
+    The pages are kept per process. `generations(user_id)` reads a counter shared by all processes
+    which an invalidation increments, a page rendered at an older generation of its user is not served.
+    """
+
+    def __init__(self, ttl=60, maxsize=10000, generations: Callable[[int], int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.generations = generations
+        # (user_id, key) -> (expires_at, body, etag, generation)
+        self._pages = OrderedDict()
+        self._user_keys = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_etag(body: bytes) -> str:
+        return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+    def generation(self, user_id: int) -> Optional[int]:
+        """Shared generation of the user pages, None when it can't be read and the cache is bypassed."""
+        if self.generations is None:
+            return 0
+        try:
+            return self.generations(user_id)
+        except (OSError, sqlite3.Error) as exc:
+            logger.warning(f"Can't read records cache generation of user {user_id}: {exc}")
+            return None
+
+    def get(self, user_id: int, key: Hashable, generation: int = 0) -> Optional[Tuple[bytes, str]]:
+        if generation is None:
+            return None
+        with self._lock:
+            cached = self._pages.get((user_id, key))
+            if cached is None:
+                return None
+            if time.monotonic() >= cached[0] or cached[3] != generation:
+                self._drop((user_id, key))
+                return None
+            self._pages.move_to_end((user_id, key))
+            return cached[1], cached[2]
+
+    def set(self, user_id: int, key: Hashable, body: bytes, generation: int = 0) -> str:
+        """Caches a page rendered at `generation`, read before the records were, and returns its etag."""
+        etag = self.make_etag(body)
+        if generation is None:
+            return etag
+        with self._lock:
+            self._pages[(user_id, key)] = time.monotonic() + self.ttl, body, etag, generation
+            self._pages.move_to_end((user_id, key))
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while len(self._pages) > self.maxsize:
+                self._drop(next(iter(self._pages)))
+        return etag
+
+    def invalidate(self, user_ids: Iterable[int]):
+        with self._lock:
+            for user_id in user_ids:
+                for key in self._user_keys.pop(user_id, ()):
+                    self._pages.pop((user_id, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._user_keys.clear()
+
+    def _drop(self, page_key):
+        self._pages.pop(page_key, None)
+        user_id, key = page_key
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def get_shared_generation(user_id: int) -> int:
+    # the job queue file is opened by every API process, an invalidation sent to one of them reaches all
+    return get_settings_job_queue(get_settings()).get_cache_generation(user_id)
+
+
+# a cached page is served while its presigned urls have at least half of the refresh margin left
+response_cache = ResponseCache(ttl=min(get_settings().RECORDS_RESPONSE_CACHE_TTL, presigner.refresh_margin // 2),
+                               maxsize=get_settings().RECORDS_RESPONSE_CACHE_SIZE,
+                               generations=get_shared_generation)
@@ -1,8 +1,15 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+
 import aiohttp
 from fastapi import Depends, Header, HTTPException
 
 from app.core.config import get_settings, BaseSettings
 from app.core.http_client import http_client
+from app.core.metrics import api_stage_seconds, timed
 
 
 async def verify_bearer_token(authorization: str = Header(...), settings: BaseSettings = Depends(get_settings)) -> None:
@@ -10,20 +17,88 @@ async def verify_bearer_token(authorization: str = Header(...), settings: BaseSe
         raise HTTPException(status_code=401, detail="Invalid authorization token")
 
 
+async def verify_metrics_token(authorization: Optional[str] = Header(None),
+                               settings: BaseSettings = Depends(get_settings)) -> None:
+    if settings.METRICS_TOKEN and authorization != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid authorization token")
+
+
+class TokenValidator:
+    """
+    Greyt token validation with a short-lived cache.
+
+    Results are kept for `ttl` seconds, rejected tokens for `negative_ttl` seconds, keyed on a hash
+    of the credentials. Concurrent validations of the same credentials share one upstream request.
+    Failures to reach Greyt are not cached.
+    """
+
+    def __init__(self, ttl=60, negative_ttl=10, maxsize=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        # key -> (expires_at, user data, rejection detail)
+        self._results = OrderedDict()
+        self._in_flight = {}
+
+    @staticmethod
+    def get_key(access_token, client, uid):
+        return hashlib.sha256('\0'.join((access_token, client, uid)).encode()).hexdigest()
+
+    async def __call__(self, http_session: aiohttp.ClientSession, url: str, access_token: str, client: str,
+                       uid: str) -> dict:
+        key = self.get_key(access_token, client, uid)
+        cached = self._results.get(key)
+        if cached is not None:
+            expires_at, data, detail = cached
+            if time.monotonic() < expires_at:
+                if detail is not None:
+                    raise HTTPException(status_code=401, detail=detail)
+                return data
+            del self._results[key]
+        task = self._in_flight.get(key)
+        if task is None:
+            headers = {'access-token': access_token, 'client': client, 'uid': uid}
+            task = asyncio.ensure_future(self._validate(http_session, url, headers, key))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # a cancelled request must not cancel the validation other requests wait for
+        return await asyncio.shield(task)
+
+    async def _validate(self, http_session, url, headers, key):
+        try:
+            async with http_session.get(url, headers=headers) as r:
+                json = await r.json()
+            if not json['success']:
+                detail = json['errors'][0] if len(json['errors']) == 1 else ''
+                self._store(key, self.negative_ttl, None, detail)
+                raise HTTPException(status_code=401, detail=detail)
+        except HTTPException as exc:
+            raise exc
+        except Exception as exc:
+            raise HTTPException(status_code=401, detail="Authentication failed.")
+        self._store(key, self.ttl, json['data'], None)
+        return json['data']
+
+    def _store(self, key, ttl, data, detail):
+        self._results[key] = time.monotonic() + ttl, data, detail
+        self._results.move_to_end(key)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+
+
+token_validator = TokenValidator(ttl=get_settings().GREYT_TOKEN_CACHE_TTL,
+                                 negative_ttl=get_settings().GREYT_TOKEN_NEGATIVE_CACHE_TTL,
+                                 maxsize=get_settings().GREYT_TOKEN_CACHE_SIZE)
+
+
 async def check_greyt_auth_token(http_session: aiohttp.ClientSession = Depends(http_client),
                                  access_token: str = Header(...),
                                  uid: str = Header(...),
                                  client: str = Header(...),
                                  settings: BaseSettings = Depends(get_settings)):
     url = f'{settings.GREYT_HOST}/api/v1/auth/validate_token/'
-    r = await http_session.get(url, headers={'access-token': access_token, 'client': client, 'uid': uid})
-    try:
-        json = await r.json()
-        if not json['success']:
-            errors = json['errors'][0] if len(json['errors']) == 1 else ''
-            raise HTTPException(status_code=401, detail=errors)
-    except HTTPException as exc:
-        raise exc
-    except Exception as exc:
-        raise HTTPException(status_code=401, detail="Authentication failed.")
-    return json['data']
+    with timed(api_stage_seconds, 'auth'):
+        return await token_validator(http_session, url, access_token, client, uid)
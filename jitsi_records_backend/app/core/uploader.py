@@ -0,0 +1,197 @@
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import getmtime, getsize, isfile, join, split
+
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# S3 rejects multipart parts smaller than 5 MB (except the last one) and more than 10000 parts
+MIN_PART_SIZE = 5 * MB
+MAX_PARTS = 10000
+CHECKSUM_ALGORITHM = 'SHA256'
+# connections botocore keeps by default, requests above it open and close their own
+DEFAULT_POOL_CONNECTIONS = 10
+
+
+def get_s3_client_config(uploads=1, concurrency=1):
+    """
+    Config of the S3 client of `uploads` running at once, each sending `concurrency` parts at a time.
+
+    Uploads carry their SHA-256 checksum over TLS, so botocore does not hash the body again to sign the request
+    and a throttled body is read once, as it is sent. The connection pool keeps a connection per part
+    in flight, so parts do not pay for a new TLS handshake.
+    """
+    return Config(s3={'payload_signing_enabled': False},
+                  max_pool_connections=max(DEFAULT_POOL_CONNECTIONS, uploads * concurrency))
+
+
+def sha256_base64(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def composite_checksum(part_checksums):
+    # what S3 reports for a multipart object: the checksum of the part checksums and the number of parts
+    digest = hashlib.sha256(b''.join(base64.b64decode(checksum) for checksum in part_checksums)).digest()
+    return f'{base64.b64encode(digest).decode()}-{len(part_checksums)}'
+
+
+class ResumableUploader:
+    """
+    Multipart S3 upload which survives process restarts.
+
+    Completed parts are written to a small json manifest next to the uploaded file,
+    so the next run continues the same multipart upload instead of starting over.
+    Interrupted uploads are never aborted here, the bucket should have
+    an AbortIncompleteMultipartUpload lifecycle rule to clean up abandoned ones.
+
+    Every part is hashed from the buffer it is sent from, so the file is read once. S3 rejects
+    a part or object whose SHA-256 does not match the sent checksum.
+    """
+    manifest_suffix = '.upload.json'
+
+    def __init__(self, s3_client, bucket_name, part_size=16 * MB, concurrency=4, limiter=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = max(1, concurrency)
+        # app.core.bandwidth.BandwidthLimiter shared by the uploads
+        self.limiter = limiter
+        self._lock = threading.Lock()
+
+    @classmethod
+    def manifest_path(cls, filename):
+        dirpath, name = split(filename)
+        return join(dirpath, f'.{name}{cls.manifest_suffix}')
+
+    def get_part_size(self, size):
+        return max(self.part_size, math.ceil(size / MAX_PARTS))
+
+    def uploaded_bytes(self, filename, size):
+        """Bytes an interrupted upload already sent according to its manifest, without asking the storage."""
+        try:
+            with open(self.manifest_path(filename)) as f:
+                manifest = json.load(f)
+            return min(size, len(manifest['parts']) * manifest['part_size'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+
+    def upload(self, filename, key):
+        """Returns the file size and its SHA-256 checksum as S3 reports it, `<checksum>-<parts>` for multipart."""
+        size = getsize(filename)
+        part_size = self.get_part_size(size)
+        if size <= part_size:
+            with open(filename, 'rb') as f:
+                body = f.read()
+            checksum = sha256_base64(body)
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=self._body(body),
+                                      ChecksumSHA256=checksum)
+            return size, checksum
+
+        manifest = self._load_manifest(filename, key, size, part_size)
+        if manifest is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket_name, Key=key,
+                                                              ChecksumAlgorithm=CHECKSUM_ALGORITHM)
+            manifest = {'key': key, 'upload_id': response['UploadId'], 'size': size,
+                        'mtime': getmtime(filename), 'part_size': part_size,
+                        'checksum_algorithm': CHECKSUM_ALGORITHM, 'parts': []}
+            self._save_manifest(filename, manifest)
+        else:
+            logger.info(f"Resuming upload of {key}: {len(manifest['parts'])} parts already uploaded.")
+
+        done = {part['PartNumber'] for part in manifest['parts']}
+        parts_count = math.ceil(size / part_size)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._upload_part, filename, manifest, part_number)
+                       for part_number in range(1, parts_count + 1) if part_number not in done]
+            try:
+                for future in as_completed(futures):
+                    part = future.result()
+                    with self._lock:
+                        manifest['parts'].append(part)
+                        self._save_manifest(filename, manifest)
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        parts = sorted(manifest['parts'], key=lambda part: part['PartNumber'])
+        self.s3_client.complete_multipart_upload(Bucket=self.bucket_name, Key=key,
+                                                 UploadId=manifest['upload_id'],
+                                                 MultipartUpload={'Parts': parts})
+        os.remove(self.manifest_path(filename))
+        return size, composite_checksum([part['ChecksumSHA256'] for part in parts])
+
+    def verify(self, key, size, checksum=None):
+        """Checks that the stored object has the size and, when S3 reports one, the checksum of the uploaded file."""
+        response = self.s3_client.head_object(Bucket=self.bucket_name, Key=key, ChecksumMode='ENABLED')
+        if response['ContentLength'] != size:
+            return False
+        stored = response.get('ChecksumSHA256')
+        if stored and checksum:
+            return stored.split('-')[0] == checksum.split('-')[0]
+        return True
+
+    def _upload_part(self, filename, manifest, part_number):
+        part_size = manifest['part_size']
+        with open(filename, 'rb') as f:
+            f.seek((part_number - 1) * part_size)
+            body = f.read(part_size)
+        checksum = sha256_base64(body)
+        response = self.s3_client.upload_part(Bucket=self.bucket_name, Key=manifest['key'],
+                                              UploadId=manifest['upload_id'],
+                                              PartNumber=part_number, Body=self._body(body),
+                                              ChecksumSHA256=checksum)
+        return {'PartNumber': part_number, 'ETag': response['ETag'], 'ChecksumSHA256': checksum}
+
+    def _body(self, data):
+        return self.limiter.body(data) if self.limiter is not None else data
+
+    def _load_manifest(self, filename, key, size, part_size):
+        manifest_path = self.manifest_path(filename)
+        if not isfile(manifest_path):
+            return None
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Broken upload manifest {manifest_path}, starting over.")
+            return None
+        if (manifest.get('key'), manifest.get('size'), manifest.get('mtime'), manifest.get('part_size'),
+                manifest.get('checksum_algorithm')) != (key, size, getmtime(filename), part_size, CHECKSUM_ALGORITHM):
+            logger.warning(f"Upload manifest {manifest_path} does not match the file, starting over.")
+            return None
+        # trust only parts the storage knows about, parts without a known checksum are sent again
+        checksums = {part['PartNumber']: part.get('ChecksumSHA256') for part in manifest['parts']}
+        try:
+            parts = self._list_parts(key, manifest['upload_id'])
+        except ClientError as exc:
+            logger.warning(f"Can't resume upload of {key}: {exc}")
+            return None
+        for part in parts:
+            part['ChecksumSHA256'] = part.get('ChecksumSHA256') or checksums.get(part['PartNumber'])
+        manifest['parts'] = [part for part in parts if part['ChecksumSHA256']]
+        return manifest
+
+    def _list_parts(self, key, upload_id):
+        parts = []
+        paginator = self.s3_client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket_name, Key=key, UploadId=upload_id):
+            parts.extend({'PartNumber': part['PartNumber'], 'ETag': part['ETag'],
+                          'ChecksumSHA256': part.get('ChecksumSHA256')} for part in page.get('Parts', []))
+        return parts
+
+    def _save_manifest(self, filename, manifest):
+        manifest_path = self.manifest_path(filename)
+        tmp_path = f'{manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
@@ -1,64 +1,205 @@
+from datetime import datetime
 from typing_extensions import TypedDict
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 from urllib.parse import urlparse
 
-import boto3
-from botocore.client import Config
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import asc, desc, or_, case
+from pydantic import TypeAdapter
+from sqlalchemy import Row, Select, and_, asc, desc, or_, func, select, union
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.metrics import api_stage_seconds, timed
+from app.core.presigner import presigner
+from app.core.response_cache import response_cache
 from app.models.jitsi_record import JitsiRecord
 from app.schemas.jitsi_record import JitsiRecordCreate, JitsiRecordItem
+from app.schemas.pagination import CountMode, decode_cursor, encode_cursor
 
-MultiResult = TypedDict('MultiResult', {'total_count': int, 'items': List[JitsiRecordItem]})
+if TYPE_CHECKING:
+    # the worker imports this module and never loads the asyncio extension
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+# total_count is None with count=none, total_count_capped means there are more than total_count records
+MultiResult = TypedDict('MultiResult', {'total_count': Optional[int], 'total_count_capped': bool,
+                                        'next_cursor': Optional[str], 'items': List[JitsiRecordItem]})
+# validates and serializes a whole page in one pass, see app.api.records
+multi_result_adapter = TypeAdapter(MultiResult)
+# columns of JitsiRecordItem, records are listed as plain rows instead of ORM objects
+ITEM_COLUMNS = (JitsiRecord.id, JitsiRecord.conversation_id, JitsiRecord.advisor_id, JitsiRecord.student_id,
+                JitsiRecord.start_time, JitsiRecord.url, JitsiRecord.creation_date, JitsiRecord.delete_reason)
+# ids are signed 64-bit integers in every database
+MAX_ID = 2 ** 63 - 1
 
 
 class CRUDJitsiRecord:
     @staticmethod
-    def create(db: Session, *, obj_in: JitsiRecordCreate) -> JitsiRecord:
-        obj_in_data = jsonable_encoder(obj_in)
+    def create(db: Session, *, obj_in: Union[JitsiRecordCreate, Dict[str, Any]]) -> JitsiRecord:
+        obj_in_data = obj_in if isinstance(obj_in, dict) else obj_in.model_dump()
         db_obj = JitsiRecord(**obj_in_data)
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        response_cache.invalidate((db_obj.advisor_id, db_obj.student_id))
         return db_obj
 
     @staticmethod
-    def get_multi(
-        db: Session, *, user_id: int = None, skip: int = 0, limit: int = 100, order_by: str = None
-    ) -> MultiResult:
-        items = db.query(JitsiRecord)
-        total_count = items.count()
+    def bulk_create(db: Session, *, objs_in: List[JitsiRecordCreate], batch_size: int = 500) -> int:
+        """
+        Inserts records with one multi-row INSERT and one commit per batch, returns the number of inserted rows.
+
+        Records already stored with the same (conversation_id, advisor_id, student_id, start_time)
+        are skipped by the uq_jitsi_records_recording key, so a re-run after a crash does not create duplicates.
+        """
+        natural_key = ('conversation_id', 'advisor_id', 'student_id', 'start_time')
+        dialect = db.get_bind().dialect.name
+        inserted = 0
+        for i in range(0, len(objs_in), batch_size):
+            batch = {}
+            for obj_in in objs_in[i:i + batch_size]:
+                values = JitsiRecordCreate.model_validate(obj_in).model_dump()
+                batch[tuple(values[column] for column in natural_key)] = values
+            # only the dialect of the engine is imported, it is already loaded by the engine
+            if dialect == 'mysql':
+                from sqlalchemy.dialects.mysql import insert as mysql_insert
+                statement = mysql_insert(JitsiRecord).prefix_with('IGNORE')
+            elif dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+                statement = sqlite_insert(JitsiRecord).on_conflict_do_nothing(index_elements=natural_key)
+            else:
+                from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+                statement = postgresql_insert(JitsiRecord).on_conflict_do_nothing(index_elements=natural_key)
+            inserted += db.execute(statement.values(list(batch.values()))).rowcount
+            db.commit()
+        return inserted
+
+    @staticmethod
+    def _user_ids(user_id: int, *where, order_by=(), limit: int = None):
+        """
+        Ids of the user records as a UNION of the advisor and the student index paths.
+
+        Each branch is ordered and limited on its own, so both are read from the list indexes
+        instead of the OR filter scanning the table.
+        """
+        branches = []
+        for column in (JitsiRecord.advisor_id, JitsiRecord.student_id):
+            branch = select(JitsiRecord.id).where(column == user_id, *where).order_by(*order_by)
+            if limit is not None:
+                branch = branch.limit(limit)
+            branches.append(select(branch.subquery().c.id))
+        return union(*branches).subquery()
+
+    @staticmethod
+    def count_statement(*, user_id: int = None, cap: int = None) -> Select:
+        """Counts user records, stops at `cap` + 1 rows when `cap` is given."""
         if user_id:
-            items = items.filter(or_(JitsiRecord.advisor_id == user_id, JitsiRecord.student_id == user_id))
+            ids = CRUDJitsiRecord._user_ids(user_id, limit=None if cap is None else cap + 1)
+        else:
+            query = select(JitsiRecord.id)
+            ids = (query if cap is None else query.limit(cap + 1)).subquery()
+        return select(func.count()).select_from(ids)
+
+    @staticmethod
+    def get_multi_statement(
+        *, user_id: int = None, skip: int = 0, limit: int = 100, order_by: str = None, cursor: str = None
+    ) -> Select:
+        """
+        Item columns of records without url last, newest first, one more than `limit` to tell whether
+        there is a next page.
+
+        Pages by `skip` or, when `cursor` is given, after the (has_url, start_time, id) position it encodes.
+        Raises ValueError for a malformed cursor or a cursor combined with `order_by`.
+        """
+        items = select(*ITEM_COLUMNS)
+        where = []
+        if cursor:
+            if order_by:
+                raise ValueError("Cursor pagination supports the default order only.")
+            try:
+                after_has_url, after_start_time, after_id = decode_cursor(cursor)
+                after_has_url, after_start_time, after_id = \
+                    int(after_has_url), datetime.fromisoformat(after_start_time), int(after_id)
+            except (TypeError, ValueError, OverflowError) as exc:
+                raise ValueError(str(exc))
+            # values the database can't bind are rejected as malformed too
+            if after_has_url not in (0, 1) or not 0 <= after_id <= MAX_ID:
+                raise ValueError("Cursor position is out of range.")
+            where.append(or_(
+                JitsiRecord.has_url < after_has_url,
+                and_(JitsiRecord.has_url == after_has_url, or_(
+                    JitsiRecord.start_time < after_start_time,
+                    and_(JitsiRecord.start_time == after_start_time, JitsiRecord.id < after_id)))))
+            skip = 0
+        default_order = (desc(JitsiRecord.has_url), desc(JitsiRecord.start_time), desc(JitsiRecord.id))
+
         if order_by:
+            if user_id:
+                items = items.where(or_(JitsiRecord.advisor_id == user_id, JitsiRecord.student_id == user_id))
             if order_by.startswith('-'):
                 order_direction = desc
                 order_by = order_by[1:]
             else:
                 order_direction = asc
             items = items.order_by(order_direction(order_by))
+        elif user_id:
+            ids = CRUDJitsiRecord._user_ids(user_id, *where, order_by=default_order,
+                                            limit=skip + limit + 1 if limit != 0 else None)
+            items = items.join(ids, JitsiRecord.id == ids.c.id).order_by(*default_order)
         else:
-            items = items.order_by(case([(or_(JitsiRecord.url.is_(None), JitsiRecord.url == ""), 1)], else_=0),
-                                   desc('start_time'))
+            items = items.where(*where).order_by(*default_order)
         items = items.offset(skip)
         if limit != 0:
-            items = items.limit(limit)
-        items = [JitsiRecordItem.from_orm(i) for i in items]
-        s3_client = boto3.client('s3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                                 aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                                 region_name='eu-central-1',
-                                 config=Config(signature_version='s3v4'))
-        for item in items:
-            if not item.url:
-                continue
-            url = urlparse(item.url).path[1:]
-            item.url = s3_client.generate_presigned_url('get_object',
-                                                        Params={'Bucket': settings.S3_BUCKET, 'Key': url},
-                                                        ExpiresIn=settings.PRESIGNED_URL_EXPIRES_IN, HttpMethod='GET')
+            items = items.limit(limit + 1)
+        return items
+
+    @staticmethod
+    def make_multi_result(rows: List[Row], total_count: Optional[int], *, limit: int = 100,
+                          order_by: str = None, count_cap: int = None) -> MultiResult:
+        """
+        Trims the extra row of get_multi_statement into `next_cursor`, presigns urls.
+
+        Items are left as dicts, multi_result_adapter validates them once when the page is serialized.
+        """
+        next_cursor = None
+        if limit != 0 and len(rows) > limit:
+            rows = rows[:limit]
+            if not order_by:
+                last = rows[-1]
+                next_cursor = encode_cursor([int(bool(last.url)), last.start_time.isoformat(), last.id])
+        total_count_capped = False
+        if count_cap is not None and total_count > count_cap:
+            total_count, total_count_capped = count_cap, True
+
+        items = [row._asdict() for row in rows]
+        with timed(api_stage_seconds, 'presign'):
+            for item in items:
+                if not item['url']:
+                    continue
+                item['url'] = presigner(urlparse(item['url']).path[1:])
         return {
             'total_count': total_count,
+            'total_count_capped': total_count_capped,
+            'next_cursor': next_cursor,
             'items': items
         }
+
+    @staticmethod
+    async def get_multi(
+        db: 'AsyncSession', *, user_id: int = None, skip: int = 0, limit: int = 100, order_by: str = None,
+        cursor: str = None, count: CountMode = CountMode.exact
+    ) -> MultiResult:
+        """
+        Lists records without url last, newest first.
+
+        `next_cursor` continues from the last returned item and is None on the last page.
+        Raises ValueError for a malformed cursor or a cursor combined with `order_by`.
+        """
+        statement = CRUDJitsiRecord.get_multi_statement(user_id=user_id, skip=skip, limit=limit, order_by=order_by,
+                                                        cursor=cursor)
+        total_count = None
+        cap = settings.RECORDS_COUNT_CAP if count == CountMode.approximate else None
+        with timed(api_stage_seconds, 'db'):
+            rows = (await db.execute(statement)).all()
+            if count != CountMode.none:
+                total_count = (await db.execute(CRUDJitsiRecord.count_statement(user_id=user_id,
+                                                                                cap=cap))).scalar_one()
+        return CRUDJitsiRecord.make_multi_result(rows, total_count, limit=limit, order_by=order_by, count_cap=cap)
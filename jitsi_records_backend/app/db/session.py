@@ -1,7 +1,73 @@
+import threading
+from functools import lru_cache
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@lru_cache()
+def get_engine():
+    return create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+
+
+def get_async_engine_kwargs() -> dict:
+    if settings.SQLALCHEMY_ASYNC_DATABASE_URI.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        # mysql closes connections idle for wait_timeout
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+@lru_cache()
+def get_async_engine():
+    # the worker and the scripts never load the asyncio extension and the async driver
+    from sqlalchemy.ext.asyncio import create_async_engine
+    return create_async_engine(settings.SQLALCHEMY_ASYNC_DATABASE_URI, **get_async_engine_kwargs())
+
+
+class LazySessionmaker:
+    """
+    Session factory bound to the engine returned by `get_engine` when the first session is made.
+
+    Importing the app does not create engines, every process (a gunicorn worker, the records worker,
+    a script) creates the ones it uses on first use.
+    """
+
+    def __init__(self, get_engine, factory=sessionmaker, **kwargs):
+        self.get_engine = get_engine
+        self.factory = factory
+        self.kwargs = kwargs
+        self._sessionmaker = None
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        if self._sessionmaker is None:
+            with self._lock:
+                if self._sessionmaker is None:
+                    self._sessionmaker = self.factory(bind=self.get_engine(), **self.kwargs)
+        return self._sessionmaker(**kwargs)
+
+
+def _async_sessionmaker(**kwargs):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    return async_sessionmaker(**kwargs)
+
+
+SessionLocal = LazySessionmaker(get_engine, autocommit=False, autoflush=False)
+# objects are read after commit by the API, expiring them would need another round trip
+AsyncSessionLocal = LazySessionmaker(get_async_engine, _async_sessionmaker, autoflush=False, expire_on_commit=False)
+
+
+async def dispose_engines():
+    """Closes the pooled connections of the engines this process created."""
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
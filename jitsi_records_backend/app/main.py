@@ -1,21 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.api import metrics
 from app.api.api import router
 from app.core.config import settings
 from app.core.http_client import http_client
-
-app = FastAPI(**settings.get_fast_api_init_keys())
+from app.core.metrics import MetricsMiddleware
+from app.db.session import dispose_engines
 
 
-@app.on_event("startup")
-async def startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the database engines are created by the first request that uses them, see app.db.session
     http_client.start()
+    yield
+    await http_client.stop()
+    await dispose_engines()
 
 
-@app.on_event("shutdown")
-async def on_shutdown() -> None:
-    await http_client.stop()
+app = FastAPI(lifespan=lifespan, **settings.get_fast_api_init_keys())
 
 
 app.add_middleware(
@@ -26,4 +31,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware, server_timing=settings.METRICS_SERVER_TIMING)
+
 app.include_router(router)
+app.include_router(metrics.router)
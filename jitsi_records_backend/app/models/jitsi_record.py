@@ -1,7 +1,7 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Enum, DateTime
+from sqlalchemy import Boolean, Column, Computed, Integer, Index, String, Enum, DateTime, UniqueConstraint
 
 from app.db.base_class import Base
 
@@ -12,12 +12,23 @@ class DeleteReasonEnum(str, enum.Enum):
 
 class JitsiRecord(Base):
     __tablename__ = 'jitsi_records'
+    __table_args__ = (
+        # one record per recording, see CRUDJitsiRecord.bulk_create
+        UniqueConstraint('conversation_id', 'advisor_id', 'student_id', 'start_time',
+                         name='uq_jitsi_records_recording'),
+        # records list of an advisor / a student in the default order
+        Index('ix_jitsi_records_advisor_list', 'advisor_id', 'has_url', 'start_time', 'id'),
+        Index('ix_jitsi_records_student_list', 'student_id', 'has_url', 'start_time', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(Integer, nullable=False)
     advisor_id = Column(Integer, nullable=False)
     student_id = Column(Integer, nullable=False)
-    start_time = Column(DateTime())
+    start_time = Column(DateTime(), index=True)
     url =  Column(String(2083))
+    has_url = Column(Boolean, Computed("url IS NOT NULL AND url <> ''", persisted=True))
+    # base64 SHA-256 of the uploaded file, `<checksum>-<parts>` for multipart uploads
+    checksum_sha256 = Column(String(64), nullable=True)
     creation_date = Column(DateTime(), default=datetime.utcnow)
     delete_reason = Column(Enum(DeleteReasonEnum), nullable=True)
@@ -1,2 +1,3 @@
 from .jitsi_record import JitsiRecordItem
-from .pagination import Pagination
+from .pagination import CountMode, Pagination
+from .records_handler import CacheInvalidation, QueueStatus
@@ -35,6 +35,7 @@ class JitsiRecordItem(JitsiRecordBase):
                                         
 class JitsiRecordCreate(JitsiRecordBase):
     url: str = Field(..., max_length=2083)
+    checksum_sha256: Optional[str] = Field(None, max_length=64)
                                            
     model_config = ConfigDict(
         json_schema_extra={
@@ -1,7 +1,40 @@
+import base64
+import enum
+import json
+from typing import Annotated, Optional
+
+from pydantic import Field
+
+
+class CountMode(str, enum.Enum):
+    exact = 'exact'
+    # counted up to RECORDS_COUNT_CAP rows
+    approximate = 'approximate'
+    none = 'none'
+
+
+# offset + limit + 1 is bound as a signed 64-bit LIMIT, the crud module shared with the worker imports
+# this one, so the bounds are pydantic ones instead of fastapi Query
+PageSize = Annotated[int, Field(ge=0, le=2 ** 62)]
+
+
 class Pagination:
-    def __init__(self, offset: int = 0, limit: int = 20):
+    # limit=0 lists all records, out of range values are rejected with 422
+    def __init__(self, offset: PageSize = 0, limit: PageSize = 20, cursor: Optional[str] = None,
+                 count: CountMode = CountMode.exact):
         self.skip = offset
         self.limit = limit
+        self.cursor = cursor
+        self.count = count
 
     def dict(self):
-        return {'skip': self.skip, 'limit': self.limit}
\ No newline at end of file
+        return {'skip': self.skip, 'limit': self.limit, 'cursor': self.cursor, 'count': self.count}
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> list:
+    """Raises ValueError for a malformed cursor."""
+    return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
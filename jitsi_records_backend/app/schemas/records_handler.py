@@ -0,0 +1,36 @@
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class QueueStatus(BaseModel):
+    depth: Dict[str, int]
+    backlog: int
+    oldest_pending_age: Optional[float]
+    # last upload decisions of the worker
+    scheduler: Optional[Dict[str, Any]] = None
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "depth": {"pending": 3, "uploading": 2, "cleaned": 120, "dead": 1},
+                "backlog": 5,
+                "oldest_pending_age": 312.5,
+                "scheduler": {"policy": "oldest", "free_bytes": 9663676416, "free_percent": 12.4,
+                              "under_pressure": True, "recording": True, "throttled": False, "workers": 8,
+                              "in_flight": 5, "pending_bytes": 2147483648, "updated_at": 1642254809.2},
+            }
+        }
+    )
+
+
+class CacheInvalidation(BaseModel):
+    user_ids: List[int]
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "user_ids": [196, 10],
+            }
+        }
+    )
@@ -0,0 +1,24 @@
+import os
+
+# settings are read at import time, benchmarks never talk to the real services
+BENCHMARK_ENV = {
+    'RECORDS_HANDLER_TOKEN': 'benchmark',
+    'RECORDS_DIR': '/tmp/benchmark_records',
+    'S3_BUCKET': 'benchmark-records',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'STORAGE_HOST': 'https://benchmark-records.s3.amazonaws.com',
+    'GREYT_HOST': 'http://greyt.invalid',
+    'DB_HOST': 'localhost',
+    'DB_PORT': '3306',
+    'DB_USERNAME': 'benchmark',
+    'DB_PASSWORD': 'benchmark',
+    'DB_DATABASE': 'benchmark',
+    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+}
+
+
+def configure_env():
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
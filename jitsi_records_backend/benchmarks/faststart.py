@@ -0,0 +1,80 @@
+"""
+Cost of moving the moov box of a record to the front and what a player has to read before the first frame.
+
+Records are synthetic mp4s laid out like jibri writes them: ftyp, mdat of 1 MB chunks, moov at the end with
+a chunk offset per chunk. A player reading the file from the start needs moov and the first chunk, so without
+faststart it reads the whole file (or waits for a range request of the tail), with faststart a few hundred KB.
+
+python -m benchmarks.faststart --sizes-mb 64 256 1024
+"""
+import argparse
+import os
+import struct
+import tempfile
+import time
+import tracemalloc
+
+from app.core.faststart import faststart, iter_boxes
+from app.core.uploader import MB
+
+CHUNK_SIZE = MB
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def make_record(filename, size):
+    ftyp = box(b'ftyp', b'isom\0\0\2\0isomiso2avc1mp41')
+    chunks = size // CHUNK_SIZE
+    offsets = [len(ftyp) + 8 + i * CHUNK_SIZE for i in range(chunks)]
+    stco = box(b'stco', b'\0\0\0\0' + struct.pack(f'>I{chunks}I', chunks, *offsets))
+    # sample tables grow with the recording length like the chunk offsets do
+    samples = chunks * 30
+    stsz = box(b'stsz', b'\0\0\0\0' + struct.pack(f'>II{samples}I', 0, samples, *[CHUNK_SIZE // 30] * samples))
+    stbl = box(b'stbl', box(b'stsd', b'\0' * 16) + stsz + stco)
+    moov = box(b'moov', box(b'mvhd', b'\0' * 100) + box(b'trak', box(b'mdia', box(b'minf', stbl))))
+    chunk = os.urandom(CHUNK_SIZE)
+    with open(filename, 'wb') as f:
+        f.write(ftyp)
+        f.write(struct.pack('>I4s', chunks * CHUNK_SIZE + 8, b'mdat'))
+        for _ in range(chunks):
+            f.write(chunk)
+        f.write(moov)
+
+
+def bytes_to_first_frame(filename):
+    # sequential read until moov and the first chunk are both in
+    with open(filename, 'rb') as f:
+        boxes = {box_type: (offset, size) for box_type, offset, _, size in iter_boxes(f, os.path.getsize(filename))}
+    moov_end = sum(boxes[b'moov'])
+    first_chunk_end = boxes[b'mdat'][0] + 8 + CHUNK_SIZE
+    return max(moov_end, first_chunk_end)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[64, 256, 1024])
+    args = parser.parse_args()
+
+    print(f'{"record":>8} {"rewrite":>9} {"rate":>12} {"peak memory":>12} {"first frame before":>19} '
+          f'{"after":>10}')
+    with tempfile.TemporaryDirectory() as dirpath:
+        for size_mb in args.sizes_mb:
+            filename = os.path.join(dirpath, '12_196_10_2022-01-15-13-53-29.mp4')
+            make_record(filename, size_mb * MB)
+            before = bytes_to_first_frame(filename)
+            tracemalloc.start()
+            started = time.perf_counter()
+            assert faststart(filename)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            after = bytes_to_first_frame(filename)
+            print(f'{size_mb:>6}MB {elapsed:>8.2f}s {size_mb / elapsed:>7.0f} MB/s {peak / MB:>10.1f}MB '
+                  f'{before / MB:>17.1f}MB {after / MB:>8.2f}MB')
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
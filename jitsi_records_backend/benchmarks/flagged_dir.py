@@ -0,0 +1,70 @@
+"""
+Records dir discovery cost on a synthetic tree of locked and leftover recording directories.
+
+python -m benchmarks.flagged_dir --dirs 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import configure_env
+
+configure_env()
+
+from app.background_tasks.lock_index import LockIndex  # noqa: E402
+from records_handler import FlaggedDir, iter_records  # noqa: E402
+
+
+def make_tree(records_dir, dirs_count):
+    for i in range(dirs_count):
+        dirpath = os.path.join(records_dir, f'session_{i}')
+        os.mkdir(dirpath)
+        with open(os.path.join(dirpath, 'metadata.json'), 'w') as f:
+            f.write('{}')
+        # every other directory is a recording being handled, the rest are leftovers without records
+        if i % 2 == 0:
+            open(os.path.join(dirpath, f'12_196_{i}_2022-01-15-13-53-29.mp4'), 'wb').close()
+            open(os.path.join(dirpath, FlaggedDir.claim_file_name), 'wb').close()
+
+
+def walk_then_flag(records_dir):
+    # discovery as it was done before: os.walk plus a second directory read per FlaggedDir
+    for dirpath, _, filenames in os.walk(records_dir):
+        cur_dir = FlaggedDir(dirpath)
+        if cur_dir.is_locked:
+            continue
+        [filename for filename in filenames if filename.endswith('.mp4')]
+
+
+def measure(title, func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    print(f'{title:<40} best {min(timings) * 1000:9.1f} ms   mean {sum(timings) / repeat * 1000:9.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dirs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as records_dir:
+        make_tree(records_dir, args.dirs)
+        measure('os.walk + FlaggedDir walk', lambda: walk_then_flag(records_dir), args.repeat)
+        measure('single scandir pass', lambda: list(iter_records(records_dir)), args.repeat)
+        index = LockIndex()
+        list(iter_records(records_dir, lock_index=index))
+        measure('single scandir pass, warm lock index', lambda: list(iter_records(records_dir, lock_index=index)),
+                args.repeat)
+        with tempfile.NamedTemporaryFile(suffix='.sqlite3') as index_file:
+            list(iter_records(records_dir, lock_index=LockIndex(index_file.name)))
+            measure('sqlite lock index, loaded per run',
+                    lambda: list(iter_records(records_dir, lock_index=LockIndex(index_file.name))), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Latency of a 100-item GET /api/records/ page: a new S3 client and signatures per request
+against the shared presigner with its url cache.
+
+python -m benchmarks.presign --requests 200 --limit 100
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import configure_env
+
+configure_env()
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.presigner import Presigner, presigner  # noqa: E402
+from app.crud import jitsi_record  # noqa: E402
+from app.crud.jitsi_record import CRUDJitsiRecord  # noqa: E402
+from app.db.base import Base  # noqa: E402
+from app.models.jitsi_record import JitsiRecord  # noqa: E402
+
+
+def get_multi(db, **kwargs):
+    # CRUDJitsiRecord.get_multi on a sync session, signing is the same
+    rows = db.execute(CRUDJitsiRecord.get_multi_statement(**kwargs)).all()
+    total_count = db.execute(CRUDJitsiRecord.count_statement(user_id=kwargs['user_id'])).scalar_one()
+    return CRUDJitsiRecord.make_multi_result(rows, total_count, limit=kwargs['limit'])
+
+
+def get_multi_new_client(db, **kwargs):
+    # the previous get_multi: a client created and every url signed for the request
+    jitsi_record.presigner = Presigner()
+    try:
+        return get_multi(db, **kwargs)
+    finally:
+        jitsi_record.presigner = presigner
+
+
+def get_multi_cold_cache(db, **kwargs):
+    presigner.clear()
+    return get_multi(db, **kwargs)
+
+
+def measure(title, func, requests):
+    func()
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    percentiles = statistics.quantiles(timings, n=100)
+    print(f'{title:<40} p50 {percentiles[49]:7.2f}ms  p99 {percentiles[98]:7.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    start_time = datetime(2022, 1, 15, 13, 53, 29)
+    db.add_all(JitsiRecord(conversation_id=i, advisor_id=196, student_id=10, start_time=start_time + timedelta(hours=i),
+                           url=f'{settings.STORAGE_HOST}/video_records/{i}_196_10.mp4') for i in range(args.limit))
+    db.commit()
+
+    page = dict(user_id=196, skip=0, limit=args.limit)
+    measure('new client per request (before)', lambda: get_multi_new_client(db, **page), args.requests)
+    measure('shared client, cold url cache', lambda: get_multi_cold_cache(db, **page), args.requests)
+    measure('shared client, warm url cache (after)', lambda: get_multi(db, **page), args.requests)
+
+
+if __name__ == '__main__':
+    main()
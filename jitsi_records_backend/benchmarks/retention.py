@@ -0,0 +1,199 @@
+"""
+Retention job against a local S3 fake and a sqlite copy of jitsi_records.
+
+The bucket holds `--objects` live records and `--expired` newly expired ones, all linked in the table.
+Compares listing the whole bucket (what key-name based expiry has to do) with the start_time query,
+then deletes the expired records with several concurrency levels and runs the orphan reconciliation.
+
+The fake keeps keys in a sorted list and adds `--list-latency` / `--delete-latency` to each call
+to emulate the S3 round trips (moto lists a bucket in O(objects) per page, which would hide everything else).
+
+python -m benchmarks.retention --objects 100000 --expired 5000 --concurrency 1 4 8
+"""
+import argparse
+import bisect
+import logging
+import resource
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import configure_env
+
+configure_env()
+
+import bucket_records_remover  # noqa: E402
+
+BUCKET = 'benchmark-records'
+STORAGE_HOST = f'https://{BUCKET}.s3.amazonaws.com'
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+
+
+class SqliteCursor:
+    """mysql-connector cursor interface on top of sqlite."""
+
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(sql.replace('%s', '?'), params)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class SqliteConnection:
+    def __init__(self):
+        self.connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self.connection.execute('CREATE TABLE jitsi_records (id INTEGER PRIMARY KEY, conversation_id INTEGER, '
+                                'advisor_id INTEGER, student_id INTEGER, start_time TEXT, url TEXT, '
+                                'delete_reason TEXT)')
+        self.connection.execute('CREATE INDEX ix_jitsi_records_start_time ON jitsi_records (start_time)')
+
+    def cursor(self):
+        return SqliteCursor(self.connection)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeS3Client:
+    """The part of the boto3 S3 client used by the retention job."""
+
+    def __init__(self, keys, list_latency, delete_latency):
+        self.keys = sorted(keys)
+        self.deleted = set()
+        self.list_latency = list_latency
+        self.delete_latency = delete_latency
+        self.last_modified = datetime.now(timezone.utc) - timedelta(days=2)
+        self._lock = threading.Lock()
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None, PageSize=1000):
+        start_after = Prefix
+        while True:
+            time.sleep(self.list_latency)
+            with self._lock:
+                i = bisect.bisect_right(self.keys, start_after)
+                page = self.keys[i:i + PageSize]
+            if not page or not page[0].startswith(Prefix):
+                return
+            start_after = page[-1]
+            yield {'Contents': [{'Key': key, 'LastModified': self.last_modified} for key in page
+                                if key.startswith(Prefix) and key not in self.deleted]}
+
+    def delete_objects(self, Bucket, Delete):
+        assert len(Delete['Objects']) <= 1000
+        time.sleep(self.delete_latency)
+        with self._lock:
+            self.deleted.update(obj['Key'] for obj in Delete['Objects'])
+        return {}
+
+
+def make_records(count, expired_count, orphaned_count):
+    now = datetime.utcnow().replace(microsecond=0)
+    expired_start, live_start = now - timedelta(days=60), now - timedelta(days=20)
+    records = []
+    for i in range(expired_count + count + orphaned_count):
+        start_time = (expired_start if i < expired_count else live_start) + timedelta(seconds=i)
+        records.append((i, 196, 10, start_time, f'video_records/{i}_196_10_{start_time:%Y-%m-%d-%H-%M-%S}.mp4'))
+    return records
+
+
+def make_db(records, orphaned_count):
+    # the last `orphaned_count` objects have no db record
+    connection = SqliteConnection()
+    connection.connection.executemany(
+        'INSERT INTO jitsi_records (conversation_id, advisor_id, student_id, start_time, url) VALUES (?, ?, ?, ?, ?)',
+        [(*record[:4], f'{STORAGE_HOST}/{record[4]}') for record in records[:len(records) - orphaned_count]])
+    connection.commit()
+    return connection
+
+
+def list_bucket(s3_client):
+    # what expiry by key names costs: every key is listed and parsed
+    stats = Counter()
+    expired_before = datetime.utcnow() - timedelta(days=30)
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=BUCKET, Prefix='video_records/'):
+        for bucket_object in page['Contents']:
+            stats['listed'] += 1
+            if bucket_records_remover.parse_record_key(bucket_object['Key'])[3] < expired_before:
+                stats['expired'] += 1
+    return stats
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(title, func):
+    started = time.perf_counter()
+    stats = func()
+    elapsed = time.perf_counter() - started
+    counters = ', '.join(f'{name} {value}' for name, value in sorted(stats.items()))
+    print(f'{title:<32} {elapsed:8.2f}s  {counters}, peak rss {peak_rss_mb():.0f} MB')
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, default=100000, help='live objects in the bucket')
+    parser.add_argument('--expired', type=int, default=5000, help='newly expired objects')
+    parser.add_argument('--orphaned', type=int, default=1000, help='objects without a db record')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--list-latency', type=float, default=0.05, help='seconds per list_objects_v2 page')
+    parser.add_argument('--delete-latency', type=float, default=0.5, help='seconds per delete_objects call')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    records = make_records(args.objects, args.expired, args.orphaned)
+    keys = [record[4] for record in records]
+    print(f'{len(keys)} objects, {args.expired} expired, {args.orphaned} orphaned, '
+          f'{args.list_latency * 1000:.0f}ms per page, {args.delete_latency * 1000:.0f}ms per delete')
+
+    s3_client = FakeS3Client(keys, args.list_latency, args.delete_latency)
+    measure('list whole bucket', lambda: list_bucket(s3_client))
+    connection = make_db(records, args.orphaned)
+    stats = measure('dry run, start_time query', lambda: bucket_records_remover.remove_expired(
+        s3_client, BUCKET, connection, 30, dry_run=True))
+    assert stats['expired'] == args.expired, stats
+
+    for concurrency in args.concurrency:
+        s3_client = FakeS3Client(keys, args.list_latency, args.delete_latency)
+        connection = make_db(records, args.orphaned)
+        stats = measure(f'expired, concurrency {concurrency}', lambda: bucket_records_remover.remove_expired(
+            s3_client, BUCKET, connection, 30, concurrency=concurrency))
+        assert stats['deleted'] == args.expired, stats
+        stats = measure('expired, next run', lambda: bucket_records_remover.remove_expired(
+            s3_client, BUCKET, connection, 30, concurrency=concurrency))
+        assert stats['deleted'] == 0, stats
+
+    stats = measure('reconcile', lambda: bucket_records_remover.remove_orphaned(
+        s3_client, BUCKET, connection, concurrency=args.concurrency[-1]))
+    assert stats['orphaned'] == args.orphaned, stats
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+Offline benchmark suite of the whole pipeline, reported as JSON to compare commits.
+
+- ingest: `RecordsHandler.parse_dir` over a synthetic Jibri output tree of `--dirs` recording directories
+  with `--mp4-size-kb` files, `--stale-locks` of them claimed by a handler which died, into moto S3 and sqlite.
+- api: `GET /api/records/` (get_multi) with `--clients` concurrent clients on a sqlite file, tokens validated
+  against a local Greyt stub with `--greyt-latency`.
+- retention: `bucket_records_remover.main` in expired and reconcile modes against the retention S3 fake
+  and a sqlite stand-in of the MySQL connection.
+
+Every scenario runs in its own process, so its peak RSS is not mixed with the others. Nothing leaves
+the machine.
+
+python -m benchmarks.run --output results.json
+python -m benchmarks.run --scenario api --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import configure_env
+
+SCENARIOS = ('ingest', 'api', 'retention')
+
+
+def percentiles(timings):
+    if not timings:
+        return None
+    timings = sorted(timings)
+
+    def at(q):
+        return round(timings[min(len(timings) - 1, int(q * len(timings)))] * 1000, 3)
+    return {'p50': at(.5), 'p90': at(.9), 'p99': at(.99), 'max': round(timings[-1] * 1000, 3)}
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def make_tree(records_dir, dirs_count, size, stale_locks):
+    stale_at = time.time() - 24 * 3600
+    payload = os.urandom(64 * 1024)
+    for i in range(dirs_count):
+        dirpath = os.path.join(records_dir, f'session_{i}')
+        os.mkdir(dirpath)
+        with open(os.path.join(dirpath, 'metadata.json'), 'w') as f:
+            f.write('{"meeting_url":"https://greyt.invalid/196_10","participants":[],"share":true}')
+        start_time = datetime(2022, 1, 15, 13, 53, 29) + timedelta(minutes=i)
+        record_path = os.path.join(dirpath, f'{i}_196_{i % 50}_{start_time:%Y-%m-%d-%H-%M-%S}.mp4')
+        with open(record_path, 'wb') as f:
+            for _ in range(size // len(payload)):
+                f.write(payload)
+            f.write(payload[:size % len(payload)])
+        # finished recordings, the handler leaves records modified within RECORDS_RECORDING_ACTIVE_SEC alone
+        os.utime(record_path, (stale_at, stale_at))
+        if i < stale_locks:
+            claim_path = os.path.join(dirpath, '.locked')
+            with open(claim_path, 'w') as f:
+                f.write('dead-handler')
+            os.utime(claim_path, (stale_at, stale_at))
+
+
+def run_ingest(args):
+    import boto3
+    from moto import mock_aws
+    from sqlalchemy import create_engine, func, select
+    from sqlalchemy.orm import Session
+
+    import records_handler
+    from app.background_tasks.job_queue import JobQueue
+    from app.core.uploader import MB, ResumableUploader, get_s3_client_config
+    from app.db.base import Base
+    from app.models.jitsi_record import JitsiRecord
+
+    timings = []
+    upload_record = records_handler.upload_record
+
+    def timed_upload_record(*upload_args):
+        started = time.perf_counter()
+        result = upload_record(*upload_args)
+        timings.append(time.perf_counter() - started)
+        return result
+    records_handler.upload_record = timed_upload_record
+
+    size = args.mp4_size_kb * 1024
+    with tempfile.TemporaryDirectory() as dirpath, mock_aws():
+        records_dir = os.path.join(dirpath, 'records')
+        os.mkdir(records_dir)
+        make_tree(records_dir, args.dirs, size, int(args.dirs * args.stale_locks))
+        s3_client = boto3.client('s3', region_name='us-east-1',
+                                 config=get_s3_client_config(args.workers, args.part_concurrency))
+        s3_client.create_bucket(Bucket=os.environ['S3_BUCKET'])
+        engine = create_engine(f'sqlite:///{os.path.join(dirpath, "records.sqlite3")}')
+        Base.metadata.create_all(engine)
+        queue = JobQueue(os.path.join(dirpath, 'queue.sqlite3'))
+        uploader = ResumableUploader(s3_client, os.environ['S3_BUCKET'], part_size=args.part_size_mb * MB,
+                                     concurrency=args.part_concurrency)
+        with Session(engine) as db:
+            handler = records_handler.RecordsHandler(db, s3_client, os.environ['S3_BUCKET'], records_dir,
+                                                     os.environ['STORAGE_HOST'], queue, args.workers, uploader)
+            started = time.perf_counter()
+            handler.parse_dir()
+            elapsed = time.perf_counter() - started
+            stored = db.execute(select(func.count()).select_from(JitsiRecord)).scalar_one()
+        left = len(os.listdir(records_dir))
+    return {
+        'params': {'dirs': args.dirs, 'mp4_size_kb': args.mp4_size_kb, 'stale_locks': args.stale_locks,
+                   'workers': args.workers, 'part_size_mb': args.part_size_mb},
+        'elapsed_s': round(elapsed, 3),
+        'throughput': {'records_per_s': round(stored / elapsed, 2),
+                       'mb_per_s': round(handler.stats['uploaded_bytes'] / MB / elapsed, 2)},
+        'latency_ms': percentiles(timings),
+        'counts': {'stored': stored, 'uploaded': handler.stats['uploaded'], 'failed': handler.stats['failed'],
+                   'dirs_left': left},
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def start_greyt_stub(port, latency):
+    from aiohttp import web
+
+    async def validate_token(request):
+        await asyncio.sleep(latency)
+        if request.headers.get('access-token') != 'benchmark':
+            return web.json_response({'success': False, 'errors': ['Invalid login credentials']}, status=401)
+        return web.json_response({'success': True, 'data': {'id': int(request.headers['uid'])}})
+
+    app = web.Application()
+    app.router.add_get('/api/v1/auth/validate_token/', validate_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def run_api_clients(args, rng):
+    import httpx
+
+    from app.core.http_client import http_client
+    from app.main import app
+
+    runner = await start_greyt_stub(int(os.environ['GREYT_HOST'].rsplit(':', 1)[1]), args.greyt_latency)
+    http_client.start()
+    timings = []
+    requests = iter([(rng.randrange(args.users), rng.choice((20, 50, 100))) for _ in range(args.requests)])
+
+    async def run_client(client):
+        for uid, limit in requests:
+            headers = {'access-token': 'benchmark', 'client': 'benchmark', 'uid': str(uid)}
+            started = time.perf_counter()
+            r = await client.get('/api/records/', params={'limit': limit}, headers=headers)
+            timings.append(time.perf_counter() - started)
+            assert r.status_code == 200, r.text
+
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+            started = time.perf_counter()
+            await asyncio.gather(*[run_client(client) for _ in range(args.clients)])
+            elapsed = time.perf_counter() - started
+    finally:
+        await http_client.stop()
+        await runner.cleanup()
+    return elapsed, timings
+
+
+def run_api(args):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from app.core.config import settings
+    from app.core.response_cache import response_cache
+    from app.db.base import Base
+    from app.models.jitsi_record import JitsiRecord
+
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI)
+    Base.metadata.create_all(engine)
+    start_time = datetime(2022, 1, 15, 13, 53, 29)
+    with Session(engine) as db:
+        db.add_all(JitsiRecord(conversation_id=i, advisor_id=1000 + i % args.users, student_id=i % args.users,
+                               start_time=start_time + timedelta(minutes=i),
+                               url=f'{settings.STORAGE_HOST}/video_records/{i}.mp4')
+                   for i in range(args.records_per_user * args.users))
+        db.commit()
+    if not args.response_cache:
+        # every request runs get_multi
+        response_cache.ttl = 0
+    elapsed, timings = asyncio.run(run_api_clients(args, random.Random(args.seed)))
+    return {
+        'params': {'users': args.users, 'records_per_user': args.records_per_user, 'clients': args.clients,
+                   'requests': args.requests, 'greyt_latency': args.greyt_latency,
+                   'response_cache': args.response_cache},
+        'elapsed_s': round(elapsed, 3),
+        'throughput': {'requests_per_s': round(args.requests / elapsed, 2)},
+        'latency_ms': percentiles(timings),
+        'counts': {'requests': len(timings)},
+    }
+
+
+def run_retention(args):
+    import boto3
+    import mysql.connector
+
+    import bucket_records_remover
+    from benchmarks.retention import FakeS3Client, make_db, make_records
+
+    records = make_records(args.objects, args.expired, args.orphaned)
+    connection = make_db(records, args.orphaned)
+    s3_client = FakeS3Client([record[4] for record in records], args.list_latency, args.delete_latency)
+    timings = []
+    delete_objects = s3_client.delete_objects
+
+    def timed_delete_objects(**kwargs):
+        started = time.perf_counter()
+        try:
+            return delete_objects(**kwargs)
+        finally:
+            timings.append(time.perf_counter() - started)
+    s3_client.delete_objects = timed_delete_objects
+    # the lambda creates its own client and connection
+    boto3.client = lambda *client_args, **kwargs: s3_client
+    mysql.connector.connect = lambda **kwargs: connection
+    os.environ['DELETE_CONCURRENCY'] = str(args.concurrency)
+
+    results = {}
+    for mode in ('expired', 'reconcile'):
+        started = time.perf_counter()
+        stats = bucket_records_remover.main(mode=mode, dry_run=False)
+        elapsed = time.perf_counter() - started
+        handled = stats.get('listed', stats.get('expired', 0))
+        results[mode] = {'elapsed_s': round(elapsed, 3), 'objects_per_s': round(handled / elapsed, 2),
+                         'deleted': stats['deleted'], 'failed': stats['failed']}
+    return {
+        'params': {'objects': args.objects, 'expired': args.expired, 'orphaned': args.orphaned,
+                   'concurrency': args.concurrency, 'list_latency': args.list_latency,
+                   'delete_latency': args.delete_latency},
+        'elapsed_s': round(sum(result['elapsed_s'] for result in results.values()), 3),
+        'throughput': {f'{mode}_objects_per_s': result['objects_per_s'] for mode, result in results.items()},
+        'latency_ms': percentiles(timings),
+        'counts': {f'{mode}_{key}': result[key] for mode, result in results.items() for key in ('deleted', 'failed')},
+    }
+
+
+def run_child(args):
+    dirpath = tempfile.mkdtemp()
+    # settings are read at import, so the environment is set before the app is imported
+    os.environ.update({
+        'RECORDS_DIR': dirpath,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(dirpath, "api.sqlite3")}',
+        'GREYT_HOST': f'http://127.0.0.1:{free_port()}',
+    })
+    configure_env()
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    started = time.perf_counter()
+    result = globals()[f'run_{args.child}'](args)
+    result['peak_rss_mb'] = peak_rss_mb()
+    result['wall_s'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(result))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Prints the relative change of every throughput, latency and peak RSS value against the baseline."""
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        if base['params'] != result['params']:
+            print(f'{name}: parameters differ from the baseline {base["params"]}', file=sys.stderr)
+        values = [(f'throughput.{key}', value, base['throughput'].get(key), True)
+                  for key, value in result['throughput'].items()]
+        values += [(f'latency_ms.{key}', value, (base.get('latency_ms') or {}).get(key), False)
+                   for key, value in (result.get('latency_ms') or {}).items()]
+        values.append(('peak_rss_mb', result['peak_rss_mb'], base.get('peak_rss_mb'), False))
+        for key, value, base_value, higher_is_better in values:
+            if not base_value:
+                continue
+            change = (value - base_value) / base_value * 100
+            worse = change < 0 if higher_is_better else change > 0
+            flag = '  REGRESSION' if worse and abs(change) >= 10 else ''
+            print(f'{name:<10} {key:<40} {base_value:>12} -> {value:<12} {change:+7.1f}%{flag}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', choices=SCENARIOS, nargs='+', default=list(SCENARIOS))
+    parser.add_argument('--output', help='JSON file to write, stdout by default')
+    parser.add_argument('--baseline', help='JSON file of a previous run to compare with')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    ingest = parser.add_argument_group('ingest')
+    ingest.add_argument('--dirs', type=int, default=200)
+    ingest.add_argument('--mp4-size-kb', type=int, default=1024)
+    ingest.add_argument('--stale-locks', type=float, default=0.1, help='share of dirs with an expired claim')
+    ingest.add_argument('--workers', type=int, default=4)
+    ingest.add_argument('--part-size-mb', type=int, default=16)
+    ingest.add_argument('--part-concurrency', type=int, default=4)
+    api = parser.add_argument_group('api')
+    api.add_argument('--users', type=int, default=50)
+    api.add_argument('--records-per-user', type=int, default=40)
+    api.add_argument('--clients', type=int, default=50)
+    api.add_argument('--requests', type=int, default=2000)
+    api.add_argument('--greyt-latency', type=float, default=0.02, help='seconds per token validation')
+    api.add_argument('--response-cache', action='store_true', help='keep the records list cache on')
+    retention = parser.add_argument_group('retention')
+    retention.add_argument('--objects', type=int, default=20000)
+    retention.add_argument('--expired', type=int, default=2000)
+    retention.add_argument('--orphaned', type=int, default=500)
+    retention.add_argument('--concurrency', type=int, default=4)
+    retention.add_argument('--list-latency', type=float, default=0.02, help='seconds per list_objects_v2 page')
+    retention.add_argument('--delete-latency', type=float, default=0.2, help='seconds per delete_objects call')
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args)
+
+    results = {
+        'meta': {'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count(), 'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds')},
+        'scenarios': {},
+    }
+    for name in args.scenario:
+        child = subprocess.run([sys.executable, '-m', 'benchmarks.run', *sys.argv[1:], '--child', name],
+                               stdout=subprocess.PIPE, text=True)
+        if child.returncode:
+            sys.exit(f'Scenario {name} failed with exit code {child.returncode}.')
+        results['scenarios'][name] = json.loads(child.stdout.strip().splitlines()[-1])
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Cost of turning 1000 records into the GET /api/records/ body: ORM objects through `from_orm`,
+response_model validation and jsonable_encoder against column rows through one TypeAdapter pass.
+
+Both read the same sqlite rows and sign urls from a warm presigner cache, so the difference is
+row loading, validation and serialization.
+
+python -m benchmarks.serialize --items 1000 --repeat 50
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import configure_env
+
+configure_env()
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from urllib.parse import urlparse  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.presigner import presigner  # noqa: E402
+from app.crud.jitsi_record import CRUDJitsiRecord, multi_result_adapter  # noqa: E402
+from app.db.base import Base  # noqa: E402
+from app.models.jitsi_record import JitsiRecord  # noqa: E402
+from app.schemas import JitsiRecordItem  # noqa: E402
+
+
+def serialize_before(db, limit):
+    # the previous path: ORM objects, from_orm per item, response_model validation, jsonable_encoder
+    items = list(db.execute(select(JitsiRecord).order_by(JitsiRecord.id.desc()).limit(limit)).scalars())
+    items = [JitsiRecordItem.from_orm(i) for i in items]
+    for item in items:
+        if item.url:
+            item.url = presigner(urlparse(item.url).path[1:])
+    result = {'total_count': len(items), 'total_count_capped': False, 'next_cursor': None, 'items': items}
+    result = multi_result_adapter.validate_python(jsonable_encoder(result))
+    return json.dumps(jsonable_encoder(result)).encode()
+
+
+def serialize_after(db, limit):
+    rows = db.execute(CRUDJitsiRecord.get_multi_statement(limit=limit)).all()
+    result = CRUDJitsiRecord.make_multi_result(rows, len(rows), limit=limit)
+    return multi_result_adapter.dump_json(multi_result_adapter.validate_python(result))
+
+
+def measure(title, func, repeat):
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    print(f'{title:<32} median {statistics.median(timings):7.2f}ms  min {min(timings):7.2f}ms  '
+          f'body {len(body)} bytes')
+    return json.loads(body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    start_time = datetime(2022, 1, 15, 13, 53, 29)
+    db.add_all(JitsiRecord(conversation_id=i, advisor_id=196, student_id=10, start_time=start_time + timedelta(hours=i),
+                           url=f'{settings.STORAGE_HOST}/video_records/{i}_196_10.mp4') for i in range(args.items))
+    db.commit()
+
+    print(f'{args.items} items per page')
+    before = measure('from_orm + jsonable (before)', lambda: serialize_before(db, args.items), args.repeat)
+    after = measure('rows + TypeAdapter (after)', lambda: serialize_after(db, args.items), args.repeat)
+    assert before['items'] == after['items']
+
+
+if __name__ == '__main__':
+    main()
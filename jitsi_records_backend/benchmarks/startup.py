@@ -0,0 +1,67 @@
+"""
+Cold import time of the entry points, measured with `python -X importtime` in fresh interpreters.
+
+- app.main: what every gunicorn worker imports before it serves.
+- worker: the ingestion worker.
+- bucket_records_remover: the cron/lambda retention job.
+
+The time is the cumulative import time of the module, the median of `--repeat` runs. The slowest imports
+are listed by their cumulative time, so a package pulled in by an unexpected module stands out.
+
+python -m benchmarks.startup --repeat 5 --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from benchmarks.common import configure_env
+
+MODULES = ('app.main', 'worker', 'bucket_records_remover')
+
+
+def parse_importtime(stderr):
+    """Returns (module, self us, cumulative us) of every `-X importtime` line."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def import_time(module, repeat=5):
+    """Median cumulative import time of `module` in seconds and the imports of the median run."""
+    runs = []
+    for _ in range(repeat):
+        child = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if child.returncode:
+            raise RuntimeError(f'import {module} failed:\n{child.stderr[-2000:]}')
+        imports = parse_importtime(child.stderr)
+        total = next(cumulative for name, _, cumulative in imports if name == module)
+        runs.append((total, imports))
+    runs.sort(key=lambda run: run[0])
+    total, imports = runs[len(runs) // 2]
+    return total / 1e6, imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=list(MODULES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    configure_env()
+    os.environ.setdefault('PYTHONPATH', os.getcwd())
+
+    for module in args.modules:
+        total, imports = import_time(module, args.repeat)
+        print(f'{module}: {total * 1000:.0f}ms')
+        for name, _, cumulative in sorted(imports, key=lambda item: -item[2])[1:args.top + 1]:
+            print(f'    {cumulative / 1000:8.1f}ms  {name}')
+
+
+if __name__ == '__main__':
+    main()
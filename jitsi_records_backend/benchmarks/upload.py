@@ -0,0 +1,127 @@
+"""
+Compares the default boto3 upload_file path with ResumableUploader against an in-process S3 fake.
+
+MB read is the read() volume of the process (rchar), page cache hits and moto reading the stored
+parts included, so a separate hashing pass shows up as the difference between rows.
+
+python -m benchmarks.upload --size-mb 256 --part-size-mb 16 --concurrency 4 [--limit-mb 32]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import boto3
+
+from app.core.bandwidth import BandwidthLimiter
+from app.core.uploader import MB, ResumableUploader, get_s3_client_config
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+BUCKET = 'benchmark-records'
+
+
+class InterruptingClient:
+    """Proxies the s3 client and fails after a given number of uploaded parts."""
+
+    def __init__(self, s3_client, fail_after):
+        self._s3_client = s3_client
+        self.fail_after = fail_after
+        self.uploaded_parts = 0
+
+    def upload_part(self, **kwargs):
+        if self.uploaded_parts >= self.fail_after:
+            raise ConnectionError('Upload interrupted')
+        self.uploaded_parts += 1
+        return self._s3_client.upload_part(**kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self._s3_client, item)
+
+
+def make_file(dirpath, size):
+    filename = os.path.join(dirpath, '12_196_10_2022-01-15-13-53-29.mp4')
+    chunk = os.urandom(MB)
+    with open(filename, 'wb') as f:
+        for _ in range(size // MB):
+            f.write(chunk)
+    return filename
+
+
+def read_bytes():
+    try:
+        with open('/proc/self/io') as f:
+            return int(next(line for line in f if line.startswith('rchar:')).split()[1])
+    except OSError:
+        return 0
+
+
+def hash_then_upload(uploader, filename, key):
+    # integrity check as a separate pass: the file is read once to hash and once to upload
+    checksum = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(MB), b''):
+            checksum.update(chunk)
+    return uploader.upload(filename, key)
+
+
+def measure(title, size, func):
+    read_before = read_bytes()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f'{title:<40} {elapsed:8.2f}s {size / MB / elapsed:10.2f} MB/s '
+          f'{(read_bytes() - read_before) / MB:8.0f} MB read')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--part-size-mb', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--limit-mb', type=float, default=0, help='also upload within this bandwidth limit')
+    args = parser.parse_args()
+    size = args.size_mb * MB
+
+    with mock_aws(), tempfile.TemporaryDirectory() as dirpath:
+        s3_client = boto3.client('s3', region_name='us-east-1', config=get_s3_client_config(1, args.concurrency))
+        s3_client.create_bucket(Bucket=BUCKET)
+        filename = make_file(dirpath, size)
+
+        measure('upload_file (default TransferConfig)', size,
+                lambda: s3_client.upload_file(filename, BUCKET, 'video_records/default.mp4'))
+        uploader = ResumableUploader(s3_client, BUCKET, part_size=args.part_size_mb * MB,
+                                     concurrency=args.concurrency)
+        measure('hash pass + ResumableUploader', size,
+                lambda: hash_then_upload(uploader, filename, 'video_records/hashed.mp4'))
+        measure('ResumableUploader', size, lambda: uploader.upload(filename, 'video_records/resumable.mp4'))
+
+        parts_count = -(-size // uploader.get_part_size(size))
+        interrupted = ResumableUploader(InterruptingClient(s3_client, parts_count // 2), BUCKET,
+                                        part_size=args.part_size_mb * MB, concurrency=1)
+        try:
+            interrupted.upload(filename, 'video_records/resumed.mp4')
+        except ConnectionError:
+            pass
+        remaining = size - parts_count // 2 * uploader.get_part_size(size)
+        elapsed = measure('ResumableUploader, resumed at 50%', remaining,
+                          lambda: uploader.upload(filename, 'video_records/resumed.mp4'))
+        print(f'{"resume re-sent":<40} {remaining / MB:8.0f} MB of {size / MB:.0f} MB, '
+              f'effective {size / MB / elapsed:.2f} MB/s')
+
+        if args.limit_mb:
+            limited = ResumableUploader(s3_client, BUCKET, part_size=args.part_size_mb * MB,
+                                        concurrency=args.concurrency, limiter=BandwidthLimiter(args.limit_mb * MB))
+            elapsed = measure(f'ResumableUploader, {args.limit_mb:g} MB/s limit', size,
+                              lambda: limited.upload(filename, 'video_records/limited.mp4'))
+            print(f'{"limit used":<40} {size / MB / elapsed / args.limit_mb * 100:8.1f}%, '
+                  f'waited {limited.limiter.throttled_sec:.2f}s in total')
+
+
+if __name__ == '__main__':
+    main()
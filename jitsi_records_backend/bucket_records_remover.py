@@ -1,48 +1,267 @@
 import logging
+import os
 import sys
-from datetime import datetime, timedelta
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 from os import getenv
+from urllib.parse import urlparse
 
 import boto3
 import mysql.connector
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 from mysql.connector import Error
 
+from records_api import invalidate_api_cache
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+RECORDS_PREFIX = 'video_records/'
+# delete_objects accepts at most 1000 keys
+DELETE_CHUNK_SIZE = 1000
+
+
+def parse_record_key(key):
+    # key example: video_records/12_196_10_2022-01-15-13-53-29.mp4
+    [conversation_id, advisor_id, student_id, start_time] = key.split('/')[-1].split('_')
+    start_time = datetime.strptime(start_time[:-4], '%Y-%m-%d-%H-%M-%S')
+    return int(conversation_id), int(advisor_id), int(student_id), start_time
+
+
+def record_url_key(url):
+    # url example: https://bucket.s3.amazonaws.com/video_records/12_196_10_2022-01-15-13-53-29.mp4
+    path = urlparse(url).path
+    index = path.find(RECORDS_PREFIX)
+    return path[index:] if index != -1 else None
+
 
-def db_unset_urls(host, database, user, password, filename):
-    [conversation_id, advisor_id, student_id, start_time] = filename.split('/')[1].split('_')
-    start_time = start_time[:-4]
-    start_time = datetime.strptime(start_time, '%Y-%m-%d-%H-%M-%S')
+def iter_expired_records(connection, expire_days, chunk_size=DELETE_CHUNK_SIZE):
+    """
+    Yields chunks of (id, bucket key, advisor_id, student_id) of records expired more than `expire_days` ago
+    and still linked to the bucket.
+
+    Pages through the start_time index by (start_time, id), so a run reads only the expired rows.
+    """
+    expired_before = datetime.utcnow() - timedelta(days=expire_days)
+    cursor = connection.cursor()
+    sql = ('SELECT id, url, start_time, advisor_id, student_id FROM jitsi_records '
+           'WHERE url IS NOT NULL AND start_time < %s {} '
+           'ORDER BY start_time, id LIMIT %s')
+    after = None
     try:
-        with mysql.connector.connect(
-                host=host,
-                user=user,
-                password=password,
-                database=database) as connection:
-            executor = connection.cursor()
-            sql = ('UPDATE jitsi_records '
-                   'SET url = NULL, delete_reason = "expired" '
-                   'WHERE conversation_id = %s '
-                   'AND advisor_id = %s '
-                   'AND student_id = %s '
-                   'AND start_time = %s ')
-            executor.execute(sql, (conversation_id, advisor_id, student_id, start_time))
+        while True:
+            if after is None:
+                cursor.execute(sql.format(''), (expired_before, chunk_size))
+            else:
+                cursor.execute(sql.format('AND (start_time > %s OR (start_time = %s AND id > %s))'),
+                               (expired_before, after[0], after[0], after[1], chunk_size))
+            rows = cursor.fetchall()
+            # the read snapshot is released between chunks
             connection.commit()
-            logger.info(f"{executor.rowcount} db records unlinked with bucket.")
-    except Error as exc:
-        logger.error(str(exc))
-        sys.exit(1)
+            if not rows:
+                return
+            yield [(record_id, record_url_key(url), advisor_id, student_id)
+                   for record_id, url, _, advisor_id, student_id in rows]
+            after = rows[-1][2], rows[-1][0]
+    finally:
+        cursor.close()
+
+
+def db_unset_urls(connection, ids, batch_size=500):
+    """Unlinks expired db records from the bucket, returns ids of successfully updated batches."""
+    ids = list(ids)
+    unset_ids = set()
+    cursor = connection.cursor()
+    for batch_number, i in enumerate(range(0, len(ids), batch_size), start=1):
+        batch = ids[i:i + batch_size]
+        sql = ('UPDATE jitsi_records '
+               "SET url = NULL, delete_reason = 'expired' "
+               'WHERE url IS NOT NULL AND id IN ({})'.format(', '.join(['%s'] * len(batch))))
+        try:
+            cursor.execute(sql, batch)
+            connection.commit()
+        except Error as exc:
+            connection.rollback()
+            logger.error(f"Batch {batch_number} of {len(batch)} records failed: {exc}")
+            continue
+        logger.info(f"Batch {batch_number}: {cursor.rowcount} db records unlinked with bucket ({len(batch)} ids).")
+        unset_ids.update(batch)
+    cursor.close()
+    return unset_ids
+
+
+def db_linked_keys(connection, records):
+    """Returns bucket keys db records with the given (conversation_id, advisor_id, student_id, start_time) link to."""
+    if not records:
+        return set()
+    cursor = connection.cursor()
+    sql = ('SELECT url FROM jitsi_records '
+           'WHERE url IS NOT NULL AND (conversation_id, advisor_id, student_id, start_time) IN ({})'
+           .format(', '.join(['(%s, %s, %s, %s)'] * len(records))))
+    cursor.execute(sql, [value for record in records for value in record])
+    linked = {record_url_key(url) for url, in cursor.fetchall()}
+    connection.commit()
+    cursor.close()
+    return linked
+
+
+def write_metrics_textfile(path, stats, mode, elapsed):
+    """Writes the run counters in the Prometheus text format, for the node_exporter textfile collector."""
+    lines = ['# HELP records_retention_files Files handled by the last retention run.',
+             '# TYPE records_retention_files gauge']
+    lines.extend(f'records_retention_files{{mode="{mode}",result="{result}"}} {count}'
+                 for result, count in sorted(stats.items()))
+    lines.extend(['# HELP records_retention_duration_seconds Duration of the last retention run.',
+                  '# TYPE records_retention_duration_seconds gauge',
+                  f'records_retention_duration_seconds{{mode="{mode}"}} {elapsed:.3f}',
+                  '# HELP records_retention_last_run_timestamp_seconds End of the last retention run.',
+                  '# TYPE records_retention_last_run_timestamp_seconds gauge',
+                  f'records_retention_last_run_timestamp_seconds{{mode="{mode}"}} {time.time():.0f}'])
+    # the collector must never read a half written file
+    with open(f'{path}.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(f'{path}.tmp', path)
+
+
+def iter_orphaned_chunks(s3_client, bucket_name, connection, grace_days, stats, chunk_size=DELETE_CHUNK_SIZE):
+    """
+    Walks the bucket listing and yields chunks of keys no db record is linked to.
+
+    Objects modified within `grace_days` are skipped, the handler uploads a record before saving it to db.
+    """
+    modified_before = datetime.now(timezone.utc) - timedelta(days=grace_days)
+    chunk = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=RECORDS_PREFIX, Delimiter='/'):
+        records = {}
+        for bucket_object in page.get('Contents', []):
+            stats['listed'] += 1
+            if bucket_object['LastModified'] > modified_before:
+                continue
+            try:
+                records[bucket_object['Key']] = parse_record_key(bucket_object['Key'])
+            except ValueError:
+                stats['unknown'] += 1
+                logger.warning(f"Can't parse record key {bucket_object['Key']}, skipped.")
+        linked = db_linked_keys(connection, list(records.values()))
+        for key in records:
+            if key in linked:
+                continue
+            chunk.append(key)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
 
 
-def main(*args, in_cloud=True, **kwargs):
+def delete_chunk(s3_client, bucket_name, chunk_number, keys):
+    response = s3_client.delete_objects(Bucket=bucket_name,
+                                        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+    errors = response.get('Errors', [])
+    for error in errors:
+        logger.error(f"Chunk {chunk_number}: {error['Key']} is not deleted: {error.get('Code')} {error.get('Message')}")
+    logger.info(f"Chunk {chunk_number}: {len(keys) - len(errors)} of {len(keys)} files deleted from bucket.")
+    return len(keys) - len(errors), len(errors)
+
+
+class ChunkDeleter:
+    """Deletes chunks of bucket keys in a thread pool, keeping at most `concurrency` chunks in flight."""
+
+    def __init__(self, s3_client, bucket_name, stats, concurrency=4):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.stats = stats
+        self.concurrency = concurrency
+        self.in_flight = set()
+
+    def __enter__(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.collect(self.in_flight)
+        self.executor.shutdown()
+
+    def submit(self, chunk_number, keys):
+        if len(self.in_flight) >= self.concurrency:
+            done, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            self.collect(done)
+        self.in_flight.add(self.executor.submit(delete_chunk, self.s3_client, self.bucket_name, chunk_number, keys))
+
+    def collect(self, futures):
+        for future in futures:
+            try:
+                deleted, failed = future.result()
+            except (BotoCoreError, ClientError) as exc:
+                logger.error(f'Chunk deletion failed: {exc}')
+                continue
+            self.stats['deleted'] += deleted
+            self.stats['failed'] += failed
+
+
+def remove_expired(s3_client, bucket_name, connection, expire_days, dry_run=False, concurrency=4,
+                   db_batch_size=500, api_url=None, api_token=None):
+    stats = Counter()
+    with ChunkDeleter(s3_client, bucket_name, stats, concurrency) as deleter:
+        for chunk_number, chunk in enumerate(iter_expired_records(connection, expire_days), start=1):
+            stats['expired'] += len(chunk)
+            if dry_run:
+                logger.info(f'Chunk {chunk_number}: {len(chunk)} files would be deleted from bucket.')
+                continue
+            # objects are deleted only once db records are unlinked from them
+            ids = db_unset_urls(connection, [record[0] for record in chunk], db_batch_size)
+            stats['unlinked'] += len(ids)
+            if api_url and ids:
+                invalidate_api_cache(api_url, api_token, {user_id for record_id, _, *user_ids in chunk
+                                                          if record_id in ids for user_id in user_ids})
+            if len(ids) < len(chunk):
+                logger.warning(f'Chunk {chunk_number}: {len(chunk) - len(ids)} records are not unlinked from db, '
+                               f'their files will be deleted by the next run.')
+            keys = sorted({key for record_id, key, *_ in chunk if record_id in ids and key})
+            stats['unknown'] += sum(1 for record_id, key, *_ in chunk if record_id in ids and not key)
+            if keys:
+                deleter.submit(chunk_number, keys)
+    return stats
+
+
+def remove_orphaned(s3_client, bucket_name, connection, grace_days=1, dry_run=False, concurrency=4):
+    """Deletes bucket objects which are not linked to any db record."""
+    stats = Counter()
+    with ChunkDeleter(s3_client, bucket_name, stats, concurrency) as deleter:
+        for chunk_number, chunk in enumerate(
+                iter_orphaned_chunks(s3_client, bucket_name, connection, grace_days, stats), start=1):
+            stats['orphaned'] += len(chunk)
+            if dry_run:
+                logger.info(f'Chunk {chunk_number}: {len(chunk)} orphaned files would be deleted from bucket.')
+                continue
+            deleter.submit(chunk_number, chunk)
+    return stats
+
+
+def main(*args, in_cloud=True, dry_run=None, mode=None, **kwargs):
     S3_BUCKET = getenv('S3_BUCKET')
     DB_HOST = getenv('DB_HOST')
     DB_DATABASE = getenv('DB_DATABASE')
     DB_USERNAME = getenv('DB_USERNAME')
     DB_PASSWORD = getenv('DB_PASSWORD')
+    DB_BATCH_SIZE = int(getenv('DB_BATCH_SIZE', 500))
+    DELETE_CONCURRENCY = int(getenv('DELETE_CONCURRENCY', 4))
+    ORPHAN_GRACE_DAYS = int(getenv('ORPHAN_GRACE_DAYS', 1))
+    RECORDS_API_URL = getenv('RECORDS_API_URL', '').rstrip('/')
+    RECORDS_HANDLER_TOKEN = getenv('RECORDS_HANDLER_TOKEN')
+    METRICS_TEXTFILE = getenv('METRICS_TEXTFILE')
+    # lambda event or environment variables
+    event = args[0] if args and isinstance(args[0], dict) else {}
+    if dry_run is None:
+        dry_run = bool(event.get('dry_run')) or getenv('DRY_RUN', '').lower() in ('1', 'true', 'yes')
+    mode = mode or event.get('mode') or getenv('RETENTION_MODE', 'expired')
+    if mode not in ('expired', 'reconcile'):
+        logger.error(f'Unknown retention mode {mode}, expected "expired" or "reconcile".')
+        sys.exit(1)
     env_vars = [S3_BUCKET, DB_HOST, DB_DATABASE, DB_USERNAME, DB_PASSWORD]
     if not in_cloud:
         access_key_id = getenv('AWS_ACCESS_KEY_ID')
@@ -54,41 +273,42 @@ def main(*args, in_cloud=True, **kwargs):
 
     EXPIRE_DAYS = 30
 
-    logger.info("Script started.")
-    logger.info(f"Expiration time is {EXPIRE_DAYS} days.")
+    logger.info(f"Script started in {mode} mode." + (" Dry run, nothing will be changed." if dry_run else ""))
+    if mode == 'expired':
+        logger.info(f"Expiration time is {EXPIRE_DAYS} days.")
 
+    started = time.monotonic()
     kw_args = {} if in_cloud else {'aws_access_key_id': access_key_id, 'aws_secret_access_key': secret_access_key}
-    s3 = boto3.resource('s3', **kw_args)
-    bucket = s3.Bucket(S3_BUCKET)
-    to_delete = set()
-    for my_bucket_object in bucket.objects.filter(Prefix='video_records/', Delimiter='/'):
-        start_time = my_bucket_object.key.split('_')[-1][:-4]
-        start_time = datetime.strptime(start_time, '%Y-%m-%d-%H-%M-%S')
-        if datetime.utcnow() < start_time + timedelta(days=EXPIRE_DAYS):
-            continue
-        to_delete.add(my_bucket_object.key)
-
-    if not to_delete:
-        logger.info("Finished.")
-        return
-
-    # Если есть, что удалять
-    to_delete_str = "\n".join(to_delete)
-    logger.info(f'Next files will be deleted from bucket:\n{to_delete_str}')
-    for filename in to_delete:
-        db_unset_urls(host=DB_HOST, database=DB_DATABASE, user=DB_USERNAME, password=DB_PASSWORD, filename=filename)
-    response = bucket.delete_objects(Delete={'Objects': [{'Key': filename} for filename in to_delete]})
-    if response.get('Deleted'):
-        deleted = {file['Key'] for file in response['Deleted']}
-        if not (to_delete - deleted):
-            logger.info('All files were deleted successfully.')
-        else:
-            not_delted_str = '\n'.join(to_delete - deleted)
-            logger.info(f'Seems like something goes wrong. These files are not deleted:\n{not_delted_str}')
-    else:
-        logger.info(f'Seems like something goes wrong. Full bucket response: {response}')
+    s3_client = boto3.client('s3', **kw_args)
+    try:
+        with mysql.connector.connect(
+                host=DB_HOST,
+                user=DB_USERNAME,
+                password=DB_PASSWORD,
+                database=DB_DATABASE) as connection:
+            if mode == 'expired':
+                stats = remove_expired(s3_client, S3_BUCKET, connection, EXPIRE_DAYS, dry_run=dry_run,
+                                       concurrency=DELETE_CONCURRENCY, db_batch_size=DB_BATCH_SIZE,
+                                       api_url=RECORDS_API_URL, api_token=RECORDS_HANDLER_TOKEN)
+            else:
+                stats = remove_orphaned(s3_client, S3_BUCKET, connection, ORPHAN_GRACE_DAYS, dry_run=dry_run,
+                                        concurrency=DELETE_CONCURRENCY)
+    except Error as exc:
+        logger.error(str(exc))
+        sys.exit(1)
 
-    logger.info("Finished.")
+    elapsed = time.monotonic() - started
+    if METRICS_TEXTFILE and not dry_run:
+        write_metrics_textfile(METRICS_TEXTFILE, stats, mode, elapsed)
+    if mode == 'expired':
+        logger.info(f"Finished in {elapsed:.1f}s. Expired {stats['expired']}, unlinked {stats['unlinked']}, "
+                    f"deleted {stats['deleted']}, not deleted {stats['failed']} files, "
+                    f"{stats['unknown']} urls outside of the bucket.")
+    else:
+        logger.info(f"Finished in {elapsed:.1f}s. Listed {stats['listed']}, orphaned {stats['orphaned']}, "
+                    f"deleted {stats['deleted']}, not deleted {stats['failed']} files, "
+                    f"{stats['unknown']} unknown keys.")
+    return dict(stats, dry_run=dry_run, mode=mode, elapsed=elapsed)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,10 @@
+#! /usr/bin/env bash
+
+# run by the tiangolo/uvicorn-gunicorn image before the app starts
+alembic upgrade head
+
+# sourced by the image start script, so gunicorn and its workers get the variable: every worker writes its
+# metrics to files in this directory and /metrics merges them, files of the previous run are removed
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
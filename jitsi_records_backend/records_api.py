@@ -0,0 +1,21 @@
+"""
+Calls of the records API made by the worker and the retention job.
+
+Only the standard library is used, the remover lambda is deployed with this file next to it.
+"""
+import json
+import logging
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+
+def invalidate_api_cache(api_url, token, user_ids):
+    # cached records lists of the users are dropped by the API, they expire on their own if it is unreachable
+    request = urllib.request.Request(f'{api_url}/api/records-handler/invalidate/',
+                                     data=json.dumps({'user_ids': sorted(user_ids)}).encode(),
+                                     headers={'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'})
+    try:
+        urllib.request.urlopen(request, timeout=5).close()
+    except Exception as exc:
+        logger.warning(f"Failed to invalidate records cache of {len(user_ids)} users: {exc}")
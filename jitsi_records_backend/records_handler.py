@@ -2,44 +2,79 @@
 metadata.json example:
 {"meeting_url":"https://dev.greytme.blackacornlabs.com/196_10","participants":[],"share":true}
 """
+import argparse
 import logging
+import math
 import os
 import shutil
+import socket
 import sys
-from datetime import datetime, timedelta
-from os import getenv, walk
-from os.path import join, isfile, split
-from pathlib import Path
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from os import getenv
+from os.path import join, isfile
 
 import boto3
+from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 
+from app.background_tasks.job_queue import FULL_SCAN_STATUS, JOB_QUEUE_FILE_NAME, JobQueue, JobState
+from app.background_tasks.lock_index import DirState, get_lock_index
+from app.background_tasks.records_watcher import get_watcher
+from app.background_tasks.scheduler import SCHEDULER_STATUS, DiskPressureScheduler
+from app.core import metrics
+from app.core.bandwidth import get_limiter
+from app.core.faststart import faststart
+from app.core.metrics import ingest_stage_seconds, start_http_server, timed, watch_job_queue
+from app.core.uploader import MB, ResumableUploader, get_s3_client_config
 from app.crud.jitsi_record import CRUDJitsiRecord
+from app.db.session import SessionLocal
+from records_api import invalidate_api_cache
 
 logger = logging.getLogger(__name__)
-load_dotenv()
 
 
 class FlaggedDir():
+    """
+    Records directory with an optional handler claim.
+
+    A claim is the `.locked` file created with O_CREAT | O_EXCL, so only one handler can own
+    a directory. The owner keeps the claim alive by renewing its mtime, a claim which was not
+    renewed for `expire_min` minutes can be taken over by another handler.
+    Timestamped `.<date>.locked` files of older handler versions are honored until they expire.
+    """
     __date_frmt = '%Y-%m-%dT%H-%M-%S'
     __locked_str = '.locked'
-    expire_min = 30
+    claim_file_name = '.locked'
+    expire_min = 5
 
-    def __init__(self, dirpath, expire_min=30):
+    def __init__(self, dirpath, expire_min=5, filenames=None):
         self.expire_min = expire_min
         self.dirpath = dirpath
         self.is_locked = False
         self.applied = None
         self.locked_file_name = None
+        self.owner = None
 
-        for _, __, filenames in walk(dirpath):
-            for filename in filenames:
-                if not filename.endswith(self.__locked_str):
+        if filenames is None:
+            filenames = scan_dir(dirpath)[1]
+        for filename in filenames:
+            if not filename.endswith(self.__locked_str):
+                continue
+            if filename == self.claim_file_name:
+                try:
+                    applied = datetime.utcfromtimestamp(os.stat(join(dirpath, filename)).st_mtime)
+                except FileNotFoundError:
                     continue
-                self.is_locked = True
-                self.applied = self.__parse_datetime(filename[1:-7])
-                self.locked_file_name = filename
-                break
+            else:
+                applied = self.__parse_datetime(filename[1:-7])
+            self.is_locked = True
+            self.applied = applied
+            self.locked_file_name = filename
             break
         # Remove lock if it is expired
         self.remove_expired_lock()
@@ -48,98 +83,566 @@ class FlaggedDir():
     def __parse_datetime(self, datetime_str):
         return datetime.strptime(datetime_str, self.__date_frmt)
 
-    @classmethod
-    def __generate_datetime_str(self):
-        return datetime.utcnow().strftime(self.__date_frmt)
-
-    def generate_locked_file_name(self):
-        return join(self.dirpath, '.{}{}'.format(self.__generate_datetime_str(), self.__locked_str))
-
     @property
     def is_expired(self):
         assert self.is_locked
         return datetime.utcnow() > self.applied + timedelta(minutes=self.expire_min)
 
+    @property
+    def locked_until(self):
+        if not self.is_locked:
+            return None
+        return (self.applied + timedelta(minutes=self.expire_min)).replace(tzinfo=timezone.utc).timestamp()
+
     @property
     def locked_file_absolute_name(self):
         assert self.is_locked
         return join(self.dirpath, self.locked_file_name)
 
+    @property
+    def claim_file_absolute_name(self):
+        return join(self.dirpath, self.claim_file_name)
+
     def remove_expired_lock(self):
         if not (self.is_locked and self.is_expired):
             return
-        self.remove_lock()
+        # expired claims are taken over atomically in lock()
+        if self.locked_file_name != self.claim_file_name and isfile(self.locked_file_absolute_name):
+            os.remove(self.locked_file_absolute_name)
+        self.is_locked = False
+        self.applied = None
+        self.locked_file_name = None
 
     def remove_lock(self):
-        if not self.is_locked:
+        if not (self.is_locked and self.owner):
             return
-        if isfile(self.locked_file_absolute_name):
-            os.remove(self.locked_file_absolute_name)
+        if self.read_owner() == self.owner:
+            os.remove(self.claim_file_absolute_name)
         self.is_locked = False
         self.applied = None
         self.locked_file_name = None
+        self.owner = None
 
-    def lock(self):
-        old_lock = self.locked_file_absolute_name if self.is_locked else None
+    def read_owner(self):
+        try:
+            with open(self.claim_file_absolute_name) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
 
-        locked_file_name = self.generate_locked_file_name()
-        Path(locked_file_name).touch()
+    def break_expired_claim(self):
+        claim_path = self.claim_file_absolute_name
+        try:
+            stat = os.stat(claim_path)
+        except FileNotFoundError:
+            return True
+        if time.time() < stat.st_mtime + self.expire_min * 60:
+            return False
+        stale_path = f'{claim_path}.{uuid.uuid4().hex}.stale'
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            # somebody else has broken it
+            return True
+        stale_stat = os.stat(stale_path)
+        if (stale_stat.st_ino, stale_stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            # the claim was renewed or re-created after the check, give it back
+            try:
+                os.link(stale_path, claim_path)
+            except FileExistsError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        return True
+
+    def lock(self):
+        """Claims the directory, returns False if it is claimed by another handler."""
+        if self.is_locked and not self.owner:
+            return False
+        claim_path = self.claim_file_absolute_name
+        try:
+            fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if not self.break_expired_claim():
+                return False
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                return False
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.owner)
         self.is_locked = True
-        self.locked_file_name = split(locked_file_name)[1]
-        self.applied = self.__parse_datetime(self.locked_file_name[1:-7])
+        self.locked_file_name = self.claim_file_name
+        self.applied = datetime.utcnow()
+        return True
+
+    def renew(self):
+        """Extends own claim, returns False if the claim was lost."""
+        if not self.owner or self.read_owner() != self.owner:
+            return False
+        os.utime(self.claim_file_absolute_name)
+        self.applied = datetime.utcnow()
+        return True
+
+
+class ClaimHeartbeat:
+    """Renews claims of the directories being handled until they are discarded."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.claims = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='claim-heartbeat', daemon=True)
+
+    def add(self, flagged_dir):
+        with self._lock:
+            self.claims[flagged_dir.dirpath] = flagged_dir
+
+    def discard(self, dirpath):
+        with self._lock:
+            return self.claims.pop(dirpath, None)
+
+    def release(self, dirpath):
+        flagged_dir = self.discard(dirpath)
+        if flagged_dir is not None:
+            try:
+                flagged_dir.remove_lock()
+            except OSError as exc:
+                logger.warning(f"Can't release claim of {dirpath}: {exc}")
 
-        if old_lock and isfile(old_lock):
-            os.remove(old_lock)
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self._lock:
+                claims = list(self.claims.values())
+            for flagged_dir in claims:
+                try:
+                    renewed = flagged_dir.renew()
+                except OSError:
+                    renewed = False
+                if not renewed:
+                    logger.warning(f"Claim of {flagged_dir.dirpath} was lost.")
+                    self.discard(flagged_dir.dirpath)
 
+    def __enter__(self):
+        self._thread.start()
+        return self
 
-def iter_records(records_dir):
-    for dirpath, dirnames, filenames in walk(records_dir):
-        cur_dir = FlaggedDir(dirpath)
-        if cur_dir.is_locked:
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+def scan_dir(dirpath):
+    dirnames, filenames = [], []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+    return dirnames, filenames
+
+
+def iter_dirs(records_dir, dirpaths=None, lock_index=None):
+    now = time.time()
+    stack = [records_dir] if dirpaths is None else list(dirpaths)
+    seen = set()
+    while stack:
+        dirpath = stack.pop()
+        seen.add(dirpath)
+        mtime_ns = None
+        try:
+            if lock_index is not None:
+                if lock_index.is_locked(dirpath, now):
+                    continue
+                mtime_ns = os.stat(dirpath).st_mtime_ns
+                if lock_index.is_unchanged(dirpath, mtime_ns, now):
+                    continue
+            dirnames, filenames = scan_dir(dirpath)
+        except OSError:
+            # already handled and removed
             continue
+        stack.extend(join(dirpath, dirname) for dirname in dirnames)
+        yield dirpath, dirnames, filenames, mtime_ns
+    if lock_index is not None and dirpaths is None:
+        lock_index.retain(seen)
 
-        for filename in filenames:
-            if filename.endswith('.mp4'):
-                # добавить временный файл, который будет говорить о том, что директория уже обрабатывается
-                cur_dir.lock()
+
+def records_mtime(dirpath, records):
+    mtime = 0
+    for filename in records:
+        try:
+            mtime = max(mtime, os.stat(join(dirpath, filename)).st_mtime)
+        except OSError:
+            continue
+    return mtime
+
+
+def iter_records(records_dir, dirpaths=None, lock_index=None, lease_min=5, heartbeat=None, settle_sec=0,
+                 unsettled=None):
+    """
+    Claims directories with records and yields their records.
+
+    A directory with a record modified within `settle_sec` is left unclaimed, jibri may still be writing it.
+    It is added to `unsettled` with the time it settles at.
+    """
+    for dirpath, dirnames, filenames, mtime_ns in iter_dirs(records_dir, dirpaths, lock_index):
+        cur_dir = FlaggedDir(dirpath, expire_min=lease_min, filenames=filenames)
+        records = [filename for filename in filenames if filename.endswith('.mp4')]
+        settles_at = records_mtime(dirpath, records) + settle_sec if records and settle_sec else 0
+        recording = settles_at > time.time()
+        if recording and unsettled is not None:
+            unsettled[dirpath] = settles_at
+        # добавить временный файл, который будет говорить о том, что директория уже обрабатывается
+        if records and not recording and cur_dir.lock():
+            if heartbeat is not None:
+                heartbeat.add(cur_dir)
+            for filename in records:
                 yield dirpath, filename
+        if lock_index is not None:
+            lock_index.set(dirpath, DirState(mtime_ns, bool(records), bool(dirnames), cur_dir.locked_until))
+    if lock_index is not None:
+        lock_index.commit()
+
+
+def parse_record_filename(filename):
+    # name example: 12_196_10_2022-01-15-13-53-29.mp4
+    [conversation_id, advisor_id, student_id, start_time] = filename.split('_')
+    start_time = datetime.strptime(start_time[:-4], '%Y-%m-%d-%H-%M-%S')
+    return dict(conversation_id=conversation_id, advisor_id=advisor_id, student_id=student_id, start_time=start_time)
+
+
+def upload_record(uploader, dirpath, filename, move_moov=False, settle_sec=0):
+    target_path = f'video_records/{filename}'
+    if move_moov:
+        # before the upload, so a resumed upload finds the file already rewritten and unchanged
+        with timed(ingest_stage_seconds, 'faststart'):
+            faststart(join(dirpath, filename), settle_sec)
+    started = time.monotonic()
+    size, checksum = uploader.upload(join(dirpath, filename), target_path)
+    return target_path, size, checksum, time.monotonic() - started
+
+
+def format_rate(size, elapsed):
+    return f"{size / 1024 / 1024 / elapsed if elapsed else 0:.2f} MB/s"
+
+
+class RecordsHandler:
+    # cleaned jobs are kept for a week for troubleshooting
+    keep_cleaned_jobs_sec = 7 * 24 * 3600
+
+    def __init__(self, db, s3_client, bucket_name, records_dir, storage_host, queue, max_workers=4, uploader=None,
+                 lock_index=None, lease_min=5, insert_batch_size=100, api_url=None, api_token=None, scheduler=None,
+                 faststart=False):
+        self.db = db
+        self.records_dir = records_dir
+        self.storage_host = storage_host
+        self.queue = queue
+        self.max_workers = max(1, max_workers)
+        self.uploader = uploader or ResumableUploader(s3_client, bucket_name)
+        self.part_concurrency = self.uploader.concurrency
+        self.limiter = self.uploader.limiter
+        if self.limiter is not None:
+            metrics.upload_limit.set_function(self.limiter.rate)
+        self.scheduler = scheduler or DiskPressureScheduler(records_dir, max_workers=self.max_workers)
+        self.decision = None
+        self.faststart = faststart
+        self.lock_index = lock_index
+        self.lease_min = lease_min
+        self.insert_batch_size = insert_batch_size
+        self.api_url = api_url.rstrip('/') if api_url else None
+        self.api_token = api_token
+        self.heartbeat = None
+        # directories jibri was still writing into and when they settle
+        self.unsettled = {}
+        self.stats = Counter()
+
+    def parse_dir(self, dirpaths=None):
+        started = time.monotonic()
+        throttled_sec = self.limiter.throttled_sec if self.limiter is not None else 0
+        self.stats.clear()
+        unsettled = {}
+        if dirpaths is None:
+            self.queue.set_status(FULL_SCAN_STATUS, time.time())
+        if self.lock_index is not None:
+            # e.g. dead-letter jobs moved back to the queue
+            self.lock_index.mark_due(self.queue.get_due_dirs())
+        with ClaimHeartbeat(self.lease_min * 60 / 3) as self.heartbeat:
+            with timed(ingest_stage_seconds, 'discover'):
+                for dirpath, filename in iter_records(self.records_dir, dirpaths, self.lock_index, self.lease_min,
+                                                      self.heartbeat, self.scheduler.recording_active_sec,
+                                                      unsettled):
+                    self.queue.enqueue(dirpath, filename)
+            self.run_jobs(self.queue.get_due_jobs(list(self.heartbeat.claims)))
+            # directories with failed jobs are released to be picked up again when their retries are due
+            for dirpath in list(self.heartbeat.claims):
+                self.heartbeat.release(dirpath)
+                self.index_retry(dirpath)
+        if self.lock_index is not None:
+            self.lock_index.commit()
+        if dirpaths is None:
+            self.unsettled.clear()
+        for dirpath in dirpaths or ():
+            self.unsettled.pop(dirpath, None)
+            self.drop_missing_dir(dirpath)
+        self.unsettled.update(unsettled)
+        self.queue.prune(self.keep_cleaned_jobs_sec)
+
+        elapsed = time.monotonic() - started
+        uploaded_bytes = self.stats['uploaded_bytes']
+        logger.info(f"Uploaded {self.stats['uploaded']} records, {uploaded_bytes} bytes "
+                    f"in {elapsed:.2f}s ({format_rate(uploaded_bytes, elapsed)}), "
+                    f"{self.stats['failed']} failed. Queue: {self.queue.depth()}.")
+        if self.limiter is not None and uploaded_bytes:
+            # the achieved rate stays well below a limit which uploads did not wait for
+            limit = self.limiter.rate()
+            logger.info(f"Upload limit now {format_rate(limit, 1) if limit else 'none'}, achieved "
+                        f"{format_rate(uploaded_bytes, elapsed)}, uploads waited "
+                        f"{self.limiter.throttled_sec - throttled_sec:.2f}s in total for the limit.")
+
+    def index_retry(self, dirpath):
+        """Lets scans skip the released directory until it is modified or its next retry is due."""
+        if self.lock_index is None:
+            return
+        state = self.lock_index.get(dirpath)
+        try:
+            # the claim file was just removed
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            state = None
+        if state is None:
+            self.lock_index.forget(dirpath)
+            return
+        retries = [job.next_attempt_at for job in self.queue.get_dir_jobs(dirpath)
+                   if job.state not in (JobState.cleaned, JobState.dead)]
+        self.lock_index.set(dirpath, state._replace(mtime_ns=mtime_ns, locked_until=None,
+                                                    retry_at=min(retries) if retries else math.inf))
+
+    def run_jobs(self, jobs):
+        uploaded, uploads = [], []
+        for job in jobs:
+            if job.state == JobState.uploaded:
+                # uploaded by a previous run
+                uploaded.append(job)
+                continue
+            if job.state == JobState.recorded:
+                self.clean(job.dirpath)
+                continue
+            try:
+                parse_record_filename(job.filename)
+            except ValueError as exc:
+                self.fail(job, f"Unexpected file name: {exc}", permanent=True)
+                continue
+            uploads.append(job)
+        self.record(uploaded)
+        uploaded = []
+        uploads = deque(self.scheduler.order(uploads, self.uploader.uploaded_bytes))
+
+        # insert and cleanup run in this thread, the db session is not shared with workers
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.scheduler.pool_size) as executor:
+            while uploads or running:
+                # free space and jibri activity are checked again before new uploads start
+                workers = self.schedule(len(running))
+                while uploads and len(running) < workers:
+                    job = uploads.popleft()
+                    logger.info(f"Handling jitsi record file {job.filename}")
+                    self.queue.set_state(job, JobState.uploading)
+                    # rewriting needs as much free space as the record, it is skipped under pressure
+                    future = executor.submit(upload_record, self.uploader, job.dirpath, job.filename,
+                                             self.faststart and not self.scheduler.under_pressure,
+                                             self.scheduler.recording_active_sec)
+                    running[future] = job._replace(state=JobState.uploading)
+                done, _ = wait(running, timeout=self.scheduler.check_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    self.scheduler.done(job)
+                    try:
+                        target_path, size, checksum, elapsed = future.result()
+                    except Exception as exc:
+                        logger.exception(f"Failed to upload jitsi record file {job.filename}")
+                        self.fail(job, exc)
+                        continue
+                    logger.info(f"Uploaded {job.filename}: {size} bytes in {elapsed:.2f}s "
+                                f"({format_rate(size, elapsed)})")
+                    self.stats['uploaded'] += 1
+                    self.stats['uploaded_bytes'] += size
+                    ingest_stage_seconds.labels(stage='upload').observe(elapsed)
+                    metrics.uploaded_records.inc()
+                    metrics.uploaded_bytes.inc(size)
+                    self.queue.set_state(job, JobState.uploaded, target_path=target_path, checksum=checksum)
+                    uploaded.append(job._replace(state=JobState.uploaded, target_path=target_path,
+                                                 checksum=checksum))
+                    if len(uploaded) >= self.insert_batch_size:
+                        self.record(uploaded)
+                        uploaded = []
+                # records finished together are inserted together, otherwise as soon as possible
+                self.record(uploaded)
+                uploaded = []
+        self.schedule(0)
 
+    def schedule(self, in_flight):
+        """Returns how many uploads may run now, applies and publishes the scheduler decisions."""
+        workers = self.scheduler.workers()
+        self.uploader.concurrency = 1 if self.scheduler.throttled else self.part_concurrency
+        status = self.scheduler.status(workers, in_flight)
+        decision = (workers, status['under_pressure'], status['throttled'])
+        if decision != self.decision:
+            logger.info(f"Running {workers} uploads: {status['free_percent']}% free, "
+                        f"under pressure: {status['under_pressure']}, jibri recording: {status['recording']}, "
+                        f"{status['pending_bytes']} bytes pending.")
+            self.decision = decision
+        metrics.disk_free_bytes.set(status['free_bytes'])
+        metrics.pending_bytes.set(status['pending_bytes'])
+        metrics.upload_workers.set(workers)
+        metrics.disk_pressure.set(int(status['under_pressure']))
+        metrics.jibri_recording.set(int(status['recording']))
+        self.queue.set_status(SCHEDULER_STATUS, status)
+        return workers
 
-def parse_dir(db, s3_client, bucket_name, records_dir, storage_host):
-    for dirpath, filename in iter_records(records_dir):
-        logger.info(f"Handling jitsi record file {filename}")
-        # get info from filename
-        # name example: 12_196_10_2022-01-15-13-53-29.mp4
-        [conversation_id, advisor_id, student_id, start_time] = filename.split('_')
-        start_time = start_time[:-4]
-        start_time = datetime.strptime(start_time, '%Y-%m-%d-%H-%M-%S')
-        # upload record
-        target_path = f'video_records/{filename}'
-        s3_client.upload_file(join(dirpath, filename), bucket_name, target_path)
-        # form link
-        url = f'{storage_host}/{target_path}'
+    def record(self, jobs):
+        if not jobs:
+            return
         # insert video data to database
-        CRUDJitsiRecord.create(db, obj_in=dict(
-            conversation_id=conversation_id,
-            advisor_id=advisor_id,
-            student_id=student_id,
-            start_time=start_time,
-            url=url))
-        # delete dirpath
-        shutil.rmtree(dirpath, ignore_errors=True)
+        objs_in = [dict(**parse_record_filename(job.filename), url=f'{self.storage_host}/{job.target_path}',
+                        checksum_sha256=job.checksum)
+                   for job in jobs]
+        try:
+            with timed(ingest_stage_seconds, 'insert'):
+                CRUDJitsiRecord.bulk_create(self.db, objs_in=objs_in, batch_size=self.insert_batch_size)
+        except Exception as exc:
+            logger.exception(f"Failed to save {len(jobs)} jitsi records")
+            self.db.rollback()
+            for job in jobs:
+                self.fail(job, exc)
+            return
+        if self.api_url:
+            invalidate_api_cache(self.api_url, self.api_token,
+                                 {int(obj_in[key]) for obj_in in objs_in for key in ('advisor_id', 'student_id')})
+        for job in jobs:
+            self.queue.set_state(job, JobState.recorded)
+        for dirpath in {job.dirpath: None for job in jobs}:
+            self.clean(dirpath)
+
+    def clean(self, dirpath):
+        # directory is removed only when every record inside it is stored and matches the uploaded object
+        jobs = self.queue.get_dir_jobs(dirpath)
+        if not all(job.state in (JobState.recorded, JobState.cleaned) for job in jobs):
+            return
+        with timed(ingest_stage_seconds, 'verify'):
+            if not all(self.verify(job) for job in jobs if job.state == JobState.recorded):
+                return
+        self.heartbeat.discard(dirpath)
+        try:
+            with timed(ingest_stage_seconds, 'rmtree'):
+                shutil.rmtree(dirpath)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logger.exception(f"Failed to remove {dirpath}")
+            for job in jobs:
+                if job.state == JobState.recorded:
+                    self.fail(job, exc)
+            return
+        for job in jobs:
+            self.queue.set_state(job, JobState.cleaned)
+
+    def verify(self, job):
+        try:
+            size = os.path.getsize(join(job.dirpath, job.filename))
+        except FileNotFoundError:
+            # removed by a previous clean
+            return True
+        try:
+            verified = self.uploader.verify(job.target_path, size, job.checksum)
+        except (BotoCoreError, ClientError) as exc:
+            logger.warning(f"Failed to verify {job.target_path}: {exc}")
+            self.fail(job, exc)
+            return False
+        if not verified:
+            # the record file is kept until somebody looks at it
+            self.fail(job, f"Uploaded object {job.target_path} does not match the record file", permanent=True)
+        return verified
+
+    def drop_missing_dir(self, dirpath):
+        if os.path.isdir(dirpath):
+            return
+        for job in self.queue.get_dir_jobs(dirpath):
+            if job.state == JobState.recorded:
+                self.queue.set_state(job, JobState.cleaned)
+            elif job.state not in (JobState.cleaned, JobState.dead):
+                self.fail(job, "Record directory is missing", permanent=True)
+
+    def fail(self, job, error, permanent=False):
+        self.stats['failed'] += 1
+        metrics.failed_records.inc()
+        if self.queue.fail(job, error, permanent) == JobState.dead:
+            logger.error(f"Jitsi record {join(job.dirpath, job.filename)} moved to dead-letter jobs: {error}")
+
+    def watch(self, poll_interval=10):
+        watcher = get_watcher(self.records_dir, poll_interval)
+        logger.info(f"Watching {self.records_dir} with {type(watcher).__name__}.")
+        try:
+            # pick up everything recorded while the watcher was not running
+            self.parse_dir()
+            for dirpaths in watcher.iter_changes(timeout=poll_interval):
+                if None in dirpaths or self.queue.pop_scan_request():
+                    self.parse_dir()
+                    continue
+                # retries which became due and records jibri finished writing
+                now = time.time()
+                dirpaths |= self.queue.get_due_dirs()
+                dirpaths |= {dirpath for dirpath, settles_at in self.unsettled.items() if settles_at <= now}
+                if dirpaths:
+                    self.parse_dir(dirpaths)
+        finally:
+            watcher.close()
+
+
+def parse_dir(db, s3_client, bucket_name, records_dir, storage_host, queue, dirpaths=None, **kwargs):
+    RecordsHandler(db, s3_client, bucket_name, records_dir, storage_host, queue, **kwargs).parse_dir(dirpaths)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--watch', action='store_true', help='keep running and handle records as soon as they appear')
+    parser.add_argument('--retry-dead', action='store_true', help='move dead-letter jobs back to the queue and exit')
+    args = parser.parse_args()
     logging.basicConfig(
         format='[%(asctime)s %(levelname)s] %(message)s',
         datefmt="%Y-%m-%d %H:%M:%S",
         level=logging.INFO)
+    # the worker imports this module with its settings already read from the environment, only the script reads .env
+    load_dotenv()
 
     access_key_id = getenv('AWS_ACCESS_KEY_ID')
     secret_access_key = getenv('AWS_SECRET_ACCESS_KEY')
     S3_BUCKET = getenv('S3_BUCKET')
     RECORDS_DIR = getenv('RECORDS_DIR')
     storage_host = getenv('STORAGE_HOST')
+    upload_workers = int(getenv('RECORDS_UPLOAD_WORKERS', 4))
+    part_size = int(getenv('S3_UPLOAD_PART_SIZE_MB', 16)) * MB
+    part_concurrency = int(getenv('S3_UPLOAD_CONCURRENCY', 4))
+    limiter = get_limiter(float(getenv('S3_UPLOAD_LIMIT_MB', 0)), getenv('S3_UPLOAD_LIMIT_SCHEDULE'))
+    poll_interval = int(getenv('RECORDS_WATCH_POLL_INTERVAL', 10))
+    lock_index = get_lock_index(getenv('RECORDS_LOCK_INDEX')) if getenv('RECORDS_LOCK_INDEX') else None
+    lease_min = int(getenv('RECORDS_LEASE_TIMEOUT_MIN', 5))
+    queue_path = getenv('RECORDS_QUEUE_PATH')
+    max_attempts = int(getenv('RECORDS_MAX_ATTEMPTS', 5))
+    retry_backoff = int(getenv('RECORDS_RETRY_BACKOFF_SEC', 30))
+    insert_batch_size = int(getenv('RECORDS_INSERT_BATCH_SIZE', 100))
+    api_url = getenv('RECORDS_API_URL')
+    api_token = getenv('RECORDS_HANDLER_TOKEN')
+    metrics_port = int(getenv('METRICS_PORT', 0))
+    schedule_policy = getenv('RECORDS_SCHEDULE_POLICY', 'oldest')
+    low_free_percent = float(getenv('RECORDS_LOW_FREE_PERCENT', 15))
+    pressure_workers = int(getenv('RECORDS_PRESSURE_UPLOAD_WORKERS', 8))
+    recording_workers = int(getenv('RECORDS_RECORDING_UPLOAD_WORKERS', 1))
+    recording_active_sec = int(getenv('RECORDS_RECORDING_ACTIVE_SEC', 30))
+    move_moov = getenv('RECORDS_FASTSTART', '').lower() in ('1', 'true', 'yes')
     if not (access_key_id and secret_access_key and RECORDS_DIR and S3_BUCKET and storage_host):
         logger.error('AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, RECORDS_DIR, S3_BUCKET or STORAGE_HOST'
                      ' not specified.')
@@ -148,6 +651,28 @@ if __name__ == '__main__':
     logger.info("Script started.")
     if storage_host.endswith('/'):
         storage_host = storage_host[:-1]
-    s3_client = boto3.client('s3', aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
-    parse_dir(s3_client, S3_BUCKET, RECORDS_DIR, storage_host)
+    queue = JobQueue(queue_path or join(RECORDS_DIR, JOB_QUEUE_FILE_NAME), max_attempts=max_attempts,
+                     backoff_base=retry_backoff)
+    if args.retry_dead:
+        logger.info(f"{queue.retry_dead()} dead-letter jobs moved back to the queue.")
+        sys.exit(0)
+    scheduler = DiskPressureScheduler(RECORDS_DIR, schedule_policy, upload_workers, pressure_workers,
+                                      recording_workers, low_free_percent, recording_active_sec)
+    s3_client = boto3.client('s3', aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+                             config=get_s3_client_config(scheduler.pool_size, part_concurrency))
+    db = SessionLocal()
+    try:
+        uploader = ResumableUploader(s3_client, S3_BUCKET, part_size=part_size, concurrency=part_concurrency,
+                                     limiter=limiter)
+        handler = RecordsHandler(db, s3_client, S3_BUCKET, RECORDS_DIR, storage_host, queue, upload_workers, uploader,
+                                 lock_index, lease_min, insert_batch_size, api_url, api_token, scheduler, move_moov)
+        if args.watch:
+            if metrics_port:
+                watch_job_queue(lambda: queue)
+                start_http_server(metrics_port)
+            handler.watch(poll_interval)
+        else:
+            handler.parse_dir()
+    finally:
+        db.close()
     logger.info("Finished.")
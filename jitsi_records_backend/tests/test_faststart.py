@@ -0,0 +1,178 @@
+import os
+import struct
+
+import pytest
+
+from app.core import faststart as faststart_module
+from app.core.faststart import FaststartError, check_rewrite, faststart, iter_boxes, relocate_moov
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def chunk_offsets_box(offsets, co64=False):
+    if co64:
+        return box(b'co64', b'\0\0\0\0' + struct.pack(f'>I{len(offsets)}Q', len(offsets), *offsets))
+    return box(b'stco', b'\0\0\0\0' + struct.pack(f'>I{len(offsets)}I', len(offsets), *offsets))
+
+
+def make_record(path, chunks, co64=False, trailer=b''):
+    """Writes an mp4 laid out like jibri does, moov after mdat, with two tracks sharing the chunks."""
+    head = box(b'ftyp', b'isom\0\0\2\0isomiso2mp41') + box(b'free', b'\0' * 10)
+    offsets, offset = [], len(head) + 8
+    for chunk in chunks:
+        offsets.append(offset)
+        offset += len(chunk)
+
+    def trak(track_offsets):
+        stbl = box(b'stbl', box(b'stsd', b'\0' * 16) + chunk_offsets_box(track_offsets, co64))
+        return box(b'trak', box(b'tkhd', b'\0' * 84) + box(b'mdia', box(b'mdhd', b'\0' * 24) + box(b'minf', stbl)))
+
+    half = len(offsets) // 2
+    moov = box(b'moov', box(b'mvhd', b'\0' * 100) + trak(offsets[:half]) + trak(offsets[half:]))
+    with open(path, 'wb') as f:
+        f.write(head + box(b'mdat', b''.join(chunks)) + moov + trailer)
+
+
+def read_layout(path):
+    """Returns the top level box types and the chunk offset tables (type, offsets) of the file."""
+    with open(path, 'rb') as f:
+        boxes = list(iter_boxes(f, os.fstat(f.fileno()).st_size))
+        _, moov_offset, header_size, moov_size = next(b for b in boxes if b[0] == b'moov')
+        f.seek(moov_offset + header_size)
+        payload = f.read(moov_size - header_size)
+    tables = []
+
+    def walk(data):
+        offset = 0
+        while offset < len(data):
+            size, box_type = struct.unpack_from('>I4s', data, offset)
+            if box_type in faststart_module.CONTAINERS:
+                walk(data[offset + 8:offset + size])
+            elif box_type in (b'stco', b'co64'):
+                count, = struct.unpack_from('>I', data, offset + 12)
+                entry_format = 'I' if box_type == b'stco' else 'Q'
+                tables.append((box_type, struct.unpack_from(f'>{count}{entry_format}', data, offset + 16)))
+            offset += size
+    walk(payload)
+    return [b[0] for b in boxes], tables
+
+
+def read_chunks(path, offsets, chunks):
+    with open(path, 'rb') as f:
+        found = []
+        for offset, chunk in zip(offsets, chunks):
+            f.seek(offset)
+            found.append(f.read(len(chunk)))
+    return found
+
+
+@pytest.fixture
+def chunks():
+    return [os.urandom(1000 + i) for i in range(20)]
+
+
+@pytest.mark.parametrize('co64', [False, True])
+def test_relocate_moov_moves_moov_and_chunk_offsets(tmp_path, chunks, co64):
+    src, dst = tmp_path / 'record.mp4', tmp_path / 'faststart.mp4'
+    make_record(src, chunks, co64=co64, trailer=box(b'free', b'tail'))
+
+    size = relocate_moov(src, dst)
+
+    assert size == os.path.getsize(dst) == os.path.getsize(src)
+    box_types, tables = read_layout(dst)
+    assert box_types == [b'ftyp', b'free', b'moov', b'mdat', b'free']
+    assert {table_type for table_type, _ in tables} == {b'co64' if co64 else b'stco'}
+    offsets = [offset for _, table in tables for offset in table]
+    assert read_chunks(dst, offsets, chunks) == chunks
+    check_rewrite(src, dst, size)
+
+
+def test_relocate_moov_converts_stco_to_co64_on_overflow(tmp_path, chunks, monkeypatch):
+    src, dst = tmp_path / 'record.mp4', tmp_path / 'faststart.mp4'
+    make_record(src, chunks)
+    # offsets moved past the moov box overflow 32 bits in multi gigabyte records, here the last chunk does
+    monkeypatch.setattr(faststart_module, 'MAX_STCO_OFFSET', max(read_layout(src)[1][-1][1]))
+
+    size = relocate_moov(src, dst)
+
+    _, tables = read_layout(dst)
+    assert {table_type for table_type, _ in tables} == {b'co64'}
+    # every 4 byte entry grew to 8 bytes
+    assert size == os.path.getsize(dst) == os.path.getsize(src) + 4 * len(chunks)
+    offsets = [offset for _, table in tables for offset in table]
+    assert read_chunks(dst, offsets, chunks) == chunks
+
+
+def test_relocate_moov_leaves_faststart_records(tmp_path, chunks):
+    src, dst = tmp_path / 'record.mp4', tmp_path / 'faststart.mp4'
+    make_record(src, chunks)
+    relocate_moov(src, dst)
+
+    assert relocate_moov(dst, tmp_path / 'again.mp4') == 0
+    assert not (tmp_path / 'again.mp4').exists()
+
+
+def test_relocate_moov_fails_on_records_being_written(tmp_path, chunks):
+    src = tmp_path / 'record.mp4'
+    make_record(src, chunks)
+    with open(src, 'r+b') as f:
+        # jibri writes moov when the recording ends
+        f.truncate(os.path.getsize(src) // 2)
+
+    with pytest.raises(FaststartError):
+        relocate_moov(src, tmp_path / 'faststart.mp4')
+
+
+def test_faststart_replaces_record(tmp_path, chunks):
+    record = tmp_path / 'record.mp4'
+    make_record(record, chunks)
+
+    assert faststart(str(record))
+    assert read_layout(record)[0] == [b'ftyp', b'free', b'moov', b'mdat']
+    assert os.listdir(tmp_path) == ['record.mp4']
+
+
+def test_faststart_skips_records_modified_recently(tmp_path, chunks):
+    record = tmp_path / 'record.mp4'
+    make_record(record, chunks)
+
+    assert not faststart(str(record), settle_sec=60)
+    assert read_layout(record)[0] == [b'ftyp', b'free', b'mdat', b'moov']
+
+
+def test_faststart_keeps_record_on_invalid_rewrite(tmp_path, chunks, monkeypatch):
+    record = tmp_path / 'record.mp4'
+    make_record(record, chunks)
+    original = record.read_bytes()
+
+    def truncated_relocate(src_path, dst_path):
+        size = relocate_moov(src_path, dst_path)
+        with open(dst_path, 'r+b') as f:
+            f.truncate(size - 100)
+        return size
+    monkeypatch.setattr(faststart_module, 'relocate_moov', truncated_relocate)
+
+    assert not faststart(str(record))
+    assert record.read_bytes() == original
+    assert os.listdir(tmp_path) == ['record.mp4']
+
+
+def test_faststart_keeps_truncated_record_rewritten_by_ffmpeg(tmp_path, chunks, monkeypatch):
+    record = tmp_path / 'record.mp4'
+    make_record(record, chunks)
+    with open(record, 'r+b') as f:
+        f.truncate(os.path.getsize(record) // 2)
+    original = record.read_bytes()
+
+    def ffmpeg_faststart(src_path, dst_path):
+        # ffmpeg remuxes whatever media data a truncated file has
+        dst = tmp_path / 'remuxed.mp4'
+        make_record(dst, chunks[:5])
+        relocate_moov(dst, dst_path)
+    monkeypatch.setattr(faststart_module.shutil, 'which', lambda name: '/usr/bin/ffmpeg')
+    monkeypatch.setattr(faststart_module, 'ffmpeg_faststart', ffmpeg_faststart)
+
+    assert not faststart(str(record))
+    assert record.read_bytes() == original
@@ -0,0 +1,26 @@
+import logging
+
+from app.background_tasks.records_handler import get_records_handler
+from app.core.config import settings
+from app.core.metrics import start_http_server, watch_job_queue
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='[%(asctime)s %(levelname)s] %(message)s',
+        datefmt="%Y-%m-%d %H:%M:%S",
+        level=logging.INFO)
+
+    logger.info("Records worker started.")
+    db = SessionLocal()
+    try:
+        handler = get_records_handler(db, settings)
+        if settings.METRICS_PORT:
+            watch_job_queue(lambda: handler.queue)
+            start_http_server(settings.METRICS_PORT)
+            logger.info(f"Serving metrics on port {settings.METRICS_PORT}.")
+        handler.watch(settings.RECORDS_WATCH_POLL_INTERVAL)
+    finally:
+        db.close()